@@ -124,7 +124,8 @@ with st.expander("📖 Getting Started Guide", expanded=False):
 st.markdown("---")
 st.markdown("### System Status")
 
-# Check backend connection
+# Check backend connection (get_documents is cached, and cleared on
+# upload/delete, so reruns don't refetch)
 from utils.api_client import get_documents
 
 status = get_documents()
@@ -1,15 +1,38 @@
 import os
+import sys
+
+# asyncio.TaskGroup / ExceptionGroup (used by /summarize) need 3.11; fail at
+# startup rather than with a NameError mid-request
+if sys.version_info < (3, 11):
+    raise RuntimeError(f"Python 3.11 or newer is required (running {sys.version.split()[0]})")
+
+import asyncio
+import codecs
+import hashlib
+import io
+import sqlite3
+import threading
+import time
+import weakref
 # Disable tqdm progress bars BEFORE any imports to avoid Windows stderr issues
 os.environ['TQDM_DISABLE'] = '1'
 import json
-from typing import Optional
+from typing import Annotated, Optional
+from contextlib import contextmanager
+from functools import lru_cache
 from fastapi import FastAPI, HTTPException, UploadFile, File
-from pydantic import BaseModel, field_validator, model_validator
-from PyPDF2 import PdfReader
-from PyPDF2.errors import PdfReadError
-import io
+from fastapi.routing import APIRoute
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+import orjson
+from pydantic import BaseModel, StringConstraints, field_validator, model_validator
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+import anyio
 import anthropic
+import httpx
 import logging
+import logging.handlers
+import queue
 from anthropic import (
     APIError,
     AuthenticationError,
@@ -20,12 +43,13 @@ from anthropic import (
     InternalServerError,
 )
 import numpy as np
-import scipy
-from scipy.spatial.distance import cosine
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
-import json
+from transformers.utils import logging as hf_logging
+import torch
 import re
+import unicodedata
+from collections import OrderedDict, deque
 
 load_dotenv()
 
@@ -37,30 +61,794 @@ if not ANTHROPIC_API_KEY:
         "Get your API key from: https://console.anthropic.com/"
     )
 
-app = FastAPI(title="AI Study Assistant", version="1.0.0")
+app = FastAPI(title="AI Study Assistant", version="1.0.0", default_response_class=ORJSONResponse)
 
-# Configure logging with UTF-8 encoding for Windows
+# Configure logging with UTF-8 encoding for Windows. Records go through a
+# queue to a background thread, so writing to the console never blocks the
+# event loop
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+log_listener.start()
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.StreamHandler()
+        logging.handlers.QueueHandler(log_queue)
     ]
 )
 logger = logging.getLogger(__name__)
 
-client = anthropic.Anthropic(
-    api_key=ANTHROPIC_API_KEY
+# Async client so Claude calls don't block the event loop. One persistent
+# HTTP/2 pool is shared by all requests so TLS handshakes are amortized.
+client = anthropic.AsyncAnthropic(
+    api_key=ANTHROPIC_API_KEY,
+    http_client=anthropic.DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=256, max_keepalive_connections=256, keepalive_expiry=60),
+        timeout=httpx.Timeout(60.0, connect=5.0)
+    ),
+    # Retries are done in create_message, inside the concurrency limit
+    max_retries=0
 )
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# "torch" (default), or "onnx" / "openvino" for exported graphs with fused kernels
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Threads per encode; 0 keeps torch's default (one per physical core). With
+# several uvicorn workers, set this to cores / workers to avoid oversubscription
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+if EMBEDDING_THREADS > 0:
+    torch.set_num_threads(EMBEDDING_THREADS)
+# For onnx/openvino, an exported file from the model repo, e.g. the dynamic-INT8
+# "onnx/model_qint8_avx512_vnni.onnx"; unset loads the default FP32 export
+EMBEDDING_MODEL_FILE = os.getenv("EMBEDDING_MODEL_FILE")
+_embedding_model: Optional[SentenceTransformer] = None
+_embedding_model_lock = threading.Lock()
+
+def get_embedding_model() -> SentenceTransformer:
+    """
+    The embedding model, loaded on first use rather than at import, so the
+    helpers in this module can be imported (e.g. by the tests) without it.
+    The server loads it at startup.
+    """
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                model = SentenceTransformer(
+                    EMBEDDING_MODEL_NAME,
+                    backend=EMBEDDING_BACKEND,
+                    model_kwargs={"file_name": EMBEDDING_MODEL_FILE} if EMBEDDING_MODEL_FILE else None
+                )
+                if EMBEDDING_BACKEND == "torch" and model.device.type == "cuda":
+                    model.half()
+                _embedding_model = model
+    return _embedding_model
 
-uploaded_documents = {}
-conversations = {}
+# One encode at a time: each already spreads across all cores. Held per
+# batch (see generate_embeddings), so uploads and queries take turns.
+embedding_lock = threading.Lock()
+# Progress bars are never shown, so tqdm never writes to (Windows) stderr
+hf_logging.disable_progress_bar()
+logging.getLogger("sentence_transformers").setLevel(logging.ERROR)
 
 # Configuration constants
 MAX_FILE_SIZE = 100 * 1024 * 1024   
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+WORD_RE = re.compile(r"\w+")
+SEMANTIC_CACHE_THRESHOLD = 0.93
+SEMANTIC_CACHE_MAX_ENTRIES = 1000
+CONTEXT_REUSE_THRESHOLD = 0.75
+MAX_CONCURRENT_CLAUDE_CALLS = int(os.getenv("ANTHROPIC_MAX_INFLIGHT", "8"))
+CLAUDE_REQUESTS_PER_MINUTE = 40
+CLAUDE_INPUT_TOKENS_PER_MINUTE = int(os.getenv("ANTHROPIC_INPUT_TOKENS_PER_MINUTE", "50000"))
+CLAUDE_MAX_RETRIES = 5
+DOCUMENT_STORE_PATH = os.getenv("DOCUMENT_STORE_PATH", "documents.db")
+DOCUMENT_HOT_CACHE_SIZE = 32
+DOCUMENT_STORE_MMAP_SIZE = 256 * 1024 * 1024
+EMBEDDING_CACHE_MAX_ENTRIES = 100_000  # ~150MB of 384-dim float32 rows
+MAX_SESSIONS = 1024
+SESSION_TTL_SECONDS = 24 * 60 * 60
+MAX_HISTORY_MESSAGES = 50
+MAX_HISTORY_CHARS = 200_000
+THREADPOOL_SIZE = 100
+FIXED_QUERY_CACHE_SIZE = 256
+SCORE_BLOCK_ROWS = 4096  # int8 rows dequantized at a time when scoring the corpus
+SUMMARY_SECTION_LENGTH = 50000  # ~12,500 tokens per Claude call
+MAX_SUMMARY_SECTIONS = 8
+MAX_BATCH_REQUESTS = 500
+
+
+class SessionContextCache:
+    """
+    Per-session retrieved contexts for follow-up questions, LRU with an idle TTL.
+
+    A context untouched for ttl seconds expires, and the least recently used
+    one is evicted once maxsize is reached, so memory stays bounded.
+    """
+
+    def __init__(self, maxsize: int = MAX_SESSIONS, ttl: float = SESSION_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()  # session_id -> (last access time, context), oldest first
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        while self.data:
+            session_id, (last_access, _) = next(iter(self.data.items()))
+            if last_access >= cutoff:
+                break
+            self.data.popitem(last=False)
+            logger.info(f"Session context expired: {session_id}")
+
+    def get(self, session_id: str) -> Optional[dict]:
+        self._expire()
+        entry = self.data.get(session_id)
+        if entry is None:
+            return None
+        self.data[session_id] = (time.monotonic(), entry[1])
+        self.data.move_to_end(session_id)
+        return entry[1]
+
+    def put(self, session_id: str, context: dict) -> None:
+        self.data[session_id] = (time.monotonic(), context)
+        self.data.move_to_end(session_id)
+        while len(self.data) > self.maxsize:
+            evicted, _ = self.data.popitem(last=False)
+            logger.info(f"Session context evicted (limit {self.maxsize}): {evicted}")
+
+    def discard(self, session_id: str) -> None:
+        self.data.pop(session_id, None)
+
+    def invalidate_scopes(self, scopes: set) -> None:
+        """Drop contexts retrieved for any of these cache scopes."""
+        for session_id in [sid for sid, (_, context) in self.data.items() if context["scope"] in scopes]:
+            del self.data[session_id]
+
+
+class ChatHistory(list):
+    """
+    A session's message list, capped at max_messages / max_chars.
+
+    Oldest messages are dropped in user/assistant pairs when an assistant
+    reply is appended, so the history always starts with a user turn and a
+    pending user turn can still be rolled back with pop(). token_count is
+    the running total of tokens Claude reported for the session.
+    """
+
+    def __init__(self, max_messages: int = MAX_HISTORY_MESSAGES, max_chars: int = MAX_HISTORY_CHARS):
+        super().__init__()
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self.token_count = 0
+
+    def append(self, message: dict) -> None:
+        super().append(message)
+        if message["role"] == "assistant":
+            self._trim()
+
+    def _trim(self) -> None:
+        excess = len(self) - self.max_messages
+        remove = excess + excess % 2 if excess > 0 else 0
+        chars = sum(len(m["content"]) for m in self[remove:])
+        # Keep at least the latest pair even if it alone is over max_chars
+        while chars > self.max_chars and len(self) - remove > 2:
+            chars -= len(self[remove]["content"]) + len(self[remove + 1]["content"])
+            remove += 2
+        if remove:
+            del self[:remove]
+            logger.info(f"Trimmed {remove} old messages from chat history")
+
+
+# session_id -> retrieved context reused while follow-up questions stay on topic.
+# Kept per worker: a miss only means the sections get retrieved again.
+session_contexts = SessionContextCache()
+
+
+class RequestRateLimiter:
+    """
+    Sliding-window limiter that keeps Claude calls under a per-minute request
+    budget and an input-token budget. Each call is charged an estimate of its
+    input when admitted, so a burst can't overshoot the budget before any
+    usage comes back. acquire() returns that charge; record_usage() corrects
+    it in place to the reported usage, and refund() drops it for an attempt
+    that failed.
+
+    Budgets are per process: with several uvicorn workers, each one gets the
+    full budget, so divide the configured limits by the worker count.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = CLAUDE_REQUESTS_PER_MINUTE,
+        input_tokens_per_minute: int = CLAUDE_INPUT_TOKENS_PER_MINUTE
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.input_tokens_per_minute = input_tokens_per_minute
+        self.timestamps = deque()
+        # [admitted_at, input_tokens, in_window] charges of recent calls. The
+        # token count is corrected in place, so a charge always leaves the
+        # window at its admission time with its final value
+        self.token_usage = deque()
+        self.tokens_in_window = 0
+
+    def _expire(self, now: float) -> None:
+        while self.timestamps and now - self.timestamps[0] >= 60:
+            self.timestamps.popleft()
+        while self.token_usage and now - self.token_usage[0][0] >= 60:
+            charge = self.token_usage.popleft()
+            self.tokens_in_window -= charge[1]
+            charge[2] = False
+
+    def _settle(self, charge: list, tokens: int) -> None:
+        if charge[2]:
+            self.tokens_in_window += tokens - charge[1]
+        charge[1] = tokens
+
+    async def acquire(self, estimated_tokens: int = 0) -> list:
+        """
+        Wait until a call fits both budgets, then charge its estimated input
+        tokens. A call bigger than the whole budget still runs once the
+        window is empty. Returns the charge for record_usage() / refund().
+        """
+        while True:
+            now = time.monotonic()
+            self._expire(now)
+            if len(self.timestamps) >= self.requests_per_minute:
+                await asyncio.sleep(60 - (now - self.timestamps[0]))
+            elif self.token_usage and self.tokens_in_window + estimated_tokens > self.input_tokens_per_minute:
+                await asyncio.sleep(60 - (now - self.token_usage[0][0]))
+            else:
+                self.timestamps.append(now)
+                charge = [now, estimated_tokens, True]
+                self.token_usage.append(charge)
+                self.tokens_in_window += estimated_tokens
+                return charge
+
+    def record_usage(self, charge: list, usage) -> None:
+        """Correct a finished call's charge to its reported input tokens (cached reads included)"""
+        self._settle(charge, (
+            (getattr(usage, "input_tokens", None) or 0)
+            + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+            + (getattr(usage, "cache_read_input_tokens", None) or 0)
+        ))
+
+    def refund(self, charge: list) -> None:
+        """Drop the token charge of an attempt that failed (its request slot stays used)"""
+        self._settle(charge, 0)
+
+
+def estimate_input_tokens(request_kwargs: dict) -> int:
+    """Rough input size of a Claude call (about 4 characters per token)"""
+    return len(orjson.dumps([request_kwargs.get("system"), request_kwargs.get("messages")])) // 4
+
+
+claude_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CLAUDE_CALLS)
+claude_rate_limiter = RequestRateLimiter()
+
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    Seconds to wait before retrying a failed Claude call, or None if the
+    error isn't worth retrying (or we're out of attempts). Honors the
+    retry-after header on 429s, otherwise backs off exponentially.
+    """
+    if attempt + 1 >= CLAUDE_MAX_RETRIES:
+        return None
+    if isinstance(error, RateLimitError):
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            return float(2 ** attempt)
+    if isinstance(error, (APIConnectionError, InternalServerError)):
+        return float(2 ** attempt)
+    return None
+
+
+async def call_claude(send, request_kwargs: dict, can_retry=lambda: True):
+    """
+    Run one Claude request behind the concurrency and rate limits, so bursts
+    queue here instead of triggering 429s. send() makes a single attempt and
+    returns the final Message; attempts that hit a 429 (or a transient 5xx)
+    are retried with backoff while holding their slot, which slows the whole
+    burst down, as long as can_retry() still allows it.
+    """
+    estimated_tokens = estimate_input_tokens(request_kwargs)
+    async with claude_semaphore:
+        for attempt in range(CLAUDE_MAX_RETRIES):
+            charge = await claude_rate_limiter.acquire(estimated_tokens)
+            try:
+                message = await send()
+            except BaseException as e:
+                claude_rate_limiter.refund(charge)
+                delay = retry_delay(e, attempt) if isinstance(e, Exception) and can_retry() else None
+                if delay is None:
+                    raise
+                logger.warning(f"Claude call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            claude_rate_limiter.record_usage(charge, message.usage)
+            return message
+
+
+async def create_message(**kwargs):
+    """client.messages.create through call_claude"""
+    return await call_claude(lambda: client.messages.create(**kwargs), kwargs)
+
+
+def connect_store(path: str) -> sqlite3.Connection:
+    """
+    Open the document database for sharing across workers: WAL lets readers
+    run alongside a writer, and mmap serves reads from the OS page cache.
+    Foreign keys are enforced, so a filename can never point at contents
+    another worker just dropped.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={DOCUMENT_STORE_MMAP_SIZE}")
+    return conn
+
+def quantize_embeddings(embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per-row int8 quantization.
+
+    Returns:
+        tuple: (int8 matrix, float32 per-row scales) such that
+        embeddings ~= quantized * scales[:, None]
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=1, initial=0.0) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.round(embeddings / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class DocumentStore:
+    """
+    Document library backed by SQLite with an in-memory LRU of hot documents.
+
+    Behaves like the dict it replaces: documents are stored as
+    {"full_text", "chunks", "embeddings", "embedding_scales", "digest"}
+    (int8 embeddings, see quantize_embeddings) and looked up by filename.
+    Contents are keyed by the digest of the uploaded bytes, so the same file
+    under several names is stored once. Cold documents live only on disk,
+    and every worker sharing the database file sees the same library: a hot
+    entry is only served while its digest still matches the database.
+    """
+
+    def __init__(self, path: str = DOCUMENT_STORE_PATH, hot_size: int = DOCUMENT_HOT_CACHE_SIZE):
+        self.conn = connect_store(path)
+        self.lock = threading.Lock()
+        self.hot = OrderedDict()
+        self.hot_size = hot_size
+        with self.lock, self._transaction():
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS document_contents ("
+                "digest TEXT PRIMARY KEY, length INTEGER NOT NULL, full_text TEXT NOT NULL, "
+                "chunks TEXT NOT NULL, embeddings BLOB NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "filename TEXT PRIMARY KEY, digest TEXT NOT NULL REFERENCES document_contents (digest))"
+            )
+            # Bumped on every change to the library, so per-worker caches of
+            # the whole corpus can tell when another worker changed it
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS library_version (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)"
+            )
+            self.conn.execute("INSERT OR IGNORE INTO library_version (id, version) VALUES (0, 0)")
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Take SQLite's write lock up front (BEGIN IMMEDIATE), so a read-then-write
+        can't interleave with another worker's; commits, or rolls back on error.
+        The caller holds self.lock.
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
+    def _remember(self, filename: str, doc: dict) -> None:
+        self.hot[filename] = doc
+        self.hot.move_to_end(filename)
+        while len(self.hot) > self.hot_size:
+            self.hot.popitem(last=False)
+
+    @staticmethod
+    def _load(digest: str, full_text: str, chunks: str, embeddings: bytes) -> dict:
+        with np.load(io.BytesIO(embeddings), allow_pickle=False) as arrays:
+            return {
+                "full_text": full_text,
+                "chunks": orjson.loads(chunks),
+                "embeddings": arrays["embeddings"],
+                "embedding_scales": arrays["scales"],
+                "digest": digest
+            }
+
+    def __contains__(self, filename: str) -> bool:
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM documents WHERE filename = ?", (filename,)).fetchone()
+        return row is not None
+
+    def __getitem__(self, filename: str) -> dict:
+        with self.lock:
+            # Another worker may have replaced or deleted the file since it
+            # was cached here, so check the (indexed, tiny) digest row first
+            row = self.conn.execute("SELECT digest FROM documents WHERE filename = ?", (filename,)).fetchone()
+            hot = self.hot.get(filename)
+            if row is not None and hot is not None and hot["digest"] == row[0]:
+                self.hot.move_to_end(filename)
+                return hot
+            self.hot.pop(filename, None)
+            if row is None:
+                raise KeyError(filename)
+            row = self.conn.execute(
+                "SELECT c.digest, c.full_text, c.chunks, c.embeddings FROM documents d "
+                "JOIN document_contents c ON c.digest = d.digest WHERE d.filename = ?", (filename,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(filename)
+        doc = self._load(*row)
+        with self.lock:
+            self._remember(filename, doc)
+        return doc
+
+    def find_digest(self, digest: str) -> Optional[dict]:
+        """The stored document with this content digest (under any filename), if any."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT digest, full_text, chunks, embeddings FROM document_contents WHERE digest = ?", (digest,)
+            ).fetchone()
+        return self._load(*row) if row else None
+
+    def __setitem__(self, filename: str, doc: dict) -> None:
+        buffer = io.BytesIO()
+        np.savez(buffer, embeddings=doc["embeddings"], scales=doc["embedding_scales"])
+        chunks = orjson.dumps(doc["chunks"])
+        with self.lock:
+            with self._transaction():
+                # Contents already stored (by any worker) are kept as they are
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO document_contents (digest, length, full_text, chunks, embeddings) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (doc["digest"], len(doc["full_text"]), doc["full_text"], chunks, buffer.getvalue())
+                )
+                previous = self.conn.execute("SELECT digest FROM documents WHERE filename = ?", (filename,)).fetchone()
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO documents (filename, digest) VALUES (?, ?)", (filename, doc["digest"])
+                )
+                if previous and previous[0] != doc["digest"]:
+                    self._drop_orphan(previous[0])
+                self._bump_version()
+            self._remember(filename, doc)
+
+    def _bump_version(self) -> None:
+        self.conn.execute("UPDATE library_version SET version = version + 1 WHERE id = 0")
+
+    def version(self) -> int:
+        """Counter that changes whenever any worker adds, replaces or deletes a document."""
+        with self.lock:
+            return self.conn.execute("SELECT version FROM library_version WHERE id = 0").fetchone()[0]
+
+    def digests(self) -> dict[str, str]:
+        """filename -> content digest for every document, without loading bodies."""
+        with self.lock:
+            return dict(self.conn.execute("SELECT filename, digest FROM documents"))
+
+    def _drop_orphan(self, digest: str) -> None:
+        self.conn.execute(
+            "DELETE FROM document_contents WHERE digest = ? "
+            "AND NOT EXISTS (SELECT 1 FROM documents WHERE digest = ?)", (digest, digest)
+        )
+
+    def __delitem__(self, filename: str) -> None:
+        with self.lock:
+            with self._transaction():
+                row = self.conn.execute("SELECT digest FROM documents WHERE filename = ?", (filename,)).fetchone()
+                if row is not None:
+                    self.conn.execute("DELETE FROM documents WHERE filename = ?", (filename,))
+                    self._drop_orphan(row[0])
+                    self._bump_version()
+            self.hot.pop(filename, None)
+        if row is None:
+            raise KeyError(filename)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def keys(self) -> list[str]:
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT filename FROM documents ORDER BY rowid")]
+
+    def length(self, filename: str) -> Optional[int]:
+        """Stored text length of one document, or None if it doesn't exist."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT c.length FROM documents d JOIN document_contents c ON c.digest = d.digest "
+                "WHERE d.filename = ?", (filename,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def lengths(self) -> list[tuple[str, int]]:
+        """(filename, text length) pairs, read without loading document bodies."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT d.filename, c.length FROM documents d JOIN document_contents c ON c.digest = d.digest "
+                "ORDER BY d.rowid"
+            ).fetchall()
+
+
+def hash_upload(fileobj) -> str:
+    """BLAKE2b digest of an uploaded file's bytes, read in 1MB blocks."""
+    digest = hashlib.blake2b(digest_size=16)
+    fileobj.seek(0)
+    while block := fileobj.read(1024 * 1024):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+def decode_text_upload(fileobj) -> str:
+    """
+    UTF-8 text of an uploaded file, decoded in 1MB blocks so an invalid file
+    is rejected at its first bad block without reading the rest. Raises
+    UnicodeDecodeError.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parts = []
+    fileobj.seek(0)
+    while block := fileobj.read(1024 * 1024):
+        # Pure-ASCII blocks (most English notes) skip the UTF-8 decoder,
+        # unless it holds the start of a character split across blocks
+        if block.isascii() and not decoder.getstate()[0]:
+            parts.append(block.decode("ascii"))
+        else:
+            parts.append(decoder.decode(block))
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
+
+
+# Opened at startup (open_stores), not at import
+uploaded_documents: DocumentStore
+
+
+class EmbeddingCache:
+    """
+    Content-addressed store of chunk embeddings in the document database.
+
+    Keys are SHA-256 of the model name and chunk text, so re-uploads and
+    chunks shared between documents are never encoded twice. Holds at most
+    max_entries rows; the least recently used are pruned after each put.
+    """
+
+    LOOKUP_BATCH = 500  # Stay under SQLite's bound-parameter limit
+
+    def __init__(self, path: str = DOCUMENT_STORE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.conn = connect_store(path)
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                "hash BLOB PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS embedding_cache_last_used ON embedding_cache (last_used)"
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        # A quantized export gives slightly different vectors, so it gets its own keys
+        model_id = f"{EMBEDDING_MODEL_NAME}:{EMBEDDING_MODEL_FILE}" if EMBEDDING_MODEL_FILE else EMBEDDING_MODEL_NAME
+        return hashlib.sha256(f"{model_id}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, np.ndarray]:
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), self.LOOKUP_BATCH):
+                batch = keys[start:start + self.LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT hash, embedding FROM embedding_cache WHERE hash IN ({placeholders})", batch
+                )
+                for key, embedding in rows:
+                    found[key] = np.frombuffer(embedding, dtype=np.float32)
+            hits = list(found)
+            for start in range(0, len(hits), self.LOOKUP_BATCH):
+                batch = hits[start:start + self.LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                self.conn.execute(
+                    f"UPDATE embedding_cache SET last_used = ? WHERE hash IN ({placeholders})", [time.time(), *batch]
+                )
+            self.conn.commit()
+        return found
+
+    def put_many(self, keys: list[bytes], embeddings: np.ndarray) -> None:
+        with self.lock:
+            now = time.time()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (hash, embedding, last_used) VALUES (?, ?, ?)",
+                [
+                    (key, np.asarray(embedding, dtype=np.float32).tobytes(), now)
+                    for key, embedding in zip(keys, embeddings)
+                ]
+            )
+            excess = self.conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM embedding_cache WHERE hash IN "
+                    "(SELECT hash FROM embedding_cache ORDER BY last_used LIMIT ?)", (excess,)
+                )
+            self.conn.commit()
+
+
+embedding_cache: EmbeddingCache
+
+
+class ConversationStore:
+    """
+    Chat histories kept in the document database, so every worker sees the
+    same sessions and they survive restarts.
+
+    A turn loads its history once, appends to it in memory and writes it
+    back with save() after Claude answers. Sessions idle for ttl seconds are
+    deleted on the next write.
+    """
+
+    def __init__(self, path: str = DOCUMENT_STORE_PATH, ttl: float = SESSION_TTL_SECONDS):
+        self.conn = connect_store(path)
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "session_id TEXT PRIMARY KEY, last_access REAL NOT NULL, "
+                "message_count INTEGER NOT NULL, messages BLOB NOT NULL, token_count INTEGER NOT NULL DEFAULT 0)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS conversations_last_access ON conversations (last_access)"
+            )
+            self.conn.commit()
+
+    def _cutoff(self) -> float:
+        # Wall-clock time, since the rows are shared between processes
+        return time.time() - self.ttl
+
+    def __contains__(self, session_id: str) -> bool:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM conversations WHERE session_id = ? AND last_access >= ?",
+                (session_id, self._cutoff())
+            ).fetchone()
+        return row is not None
+
+    def get(self, session_id: str) -> Optional[ChatHistory]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT messages, token_count FROM conversations WHERE session_id = ? AND last_access >= ?",
+                (session_id, self._cutoff())
+            ).fetchone()
+        if row is None:
+            return None
+        history = ChatHistory()
+        history.extend(orjson.loads(row[0]))
+        history.token_count = row[1]
+        return history
+
+    def save(self, session_id: str, history: ChatHistory) -> None:
+        with self.lock:
+            expired = self.conn.execute(
+                "DELETE FROM conversations WHERE last_access < ?", (self._cutoff(),)
+            ).rowcount
+            self.conn.execute(
+                "INSERT OR REPLACE INTO conversations (session_id, last_access, message_count, messages, token_count) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, time.time(), len(history), orjson.dumps(history), history.token_count)
+            )
+            self.conn.commit()
+        if expired:
+            logger.info(f"Expired {expired} idle conversation(s)")
+
+    def __delitem__(self, session_id: str) -> None:
+        with self.lock:
+            deleted = self.conn.execute(
+                "DELETE FROM conversations WHERE session_id = ?", (session_id,)
+            ).rowcount
+            self.conn.commit()
+        if not deleted:
+            raise KeyError(session_id)
+
+    def message_counts(self) -> list[tuple[str, int]]:
+        """(session_id, message count) of live sessions, without loading the messages."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT session_id, message_count FROM conversations WHERE last_access >= ? ORDER BY rowid",
+                (self._cutoff(),)
+            ).fetchall()
+
+
+conversations: ConversationStore
+
+
+class ChatBatchStore:
+    """
+    Requests submitted through /chat/batch, keyed by Anthropic custom_id, so
+    any worker can merge a finished batch back into the right sessions.
+    cache_entry (JSON) and question_embedding (float32 bytes) hold what a
+    first-turn answer needs to enter the answer cache; both are NULL when
+    the turn had prior history.
+    """
+
+    def __init__(self, path: str = DOCUMENT_STORE_PATH):
+        self.conn = connect_store(path)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_batch_requests ("
+                "custom_id TEXT PRIMARY KEY, batch_id TEXT NOT NULL, session_id TEXT NOT NULL, "
+                "message TEXT NOT NULL, response TEXT, error TEXT, merged INTEGER NOT NULL DEFAULT 0, "
+                "cache_entry TEXT, question_embedding BLOB)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS chat_batch_requests_batch ON chat_batch_requests (batch_id)"
+            )
+            self.conn.commit()
+
+    def add(self, rows: list[dict]) -> None:
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO chat_batch_requests "
+                "(custom_id, batch_id, session_id, message, response, merged, cache_entry, question_embedding) "
+                "VALUES (:custom_id, :batch_id, :session_id, :message, :response, :merged, :cache_entry, :question_embedding)",
+                [
+                    {**row, "question_embedding": None if row["question_embedding"] is None
+                     else np.asarray(row["question_embedding"], dtype=np.float32).tobytes()}
+                    for row in rows
+                ]
+            )
+            self.conn.commit()
+
+    def get(self, batch_id: str) -> list[dict]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT custom_id, session_id, message, response, error, merged, cache_entry, question_embedding "
+                "FROM chat_batch_requests "
+                "WHERE batch_id = ? ORDER BY rowid", (batch_id,)
+            ).fetchall()
+        return [
+            {"custom_id": row[0], "session_id": row[1], "message": row[2],
+             "response": row[3], "error": row[4], "merged": bool(row[5]),
+             "cache_entry": orjson.loads(row[6]) if row[6] else None,
+             "question_embedding": np.frombuffer(row[7], dtype=np.float32) if row[7] else None}
+            for row in rows
+        ]
+
+    def mark_merged(self, custom_id: str, response: Optional[str], error: Optional[str]) -> bool:
+        """
+        Record a request's result and claim it for merging. Only the first
+        caller (in any worker) gets True; the others must not merge it again.
+        """
+        with self.lock:
+            claimed = self.conn.execute(
+                "UPDATE chat_batch_requests SET response = ?, error = ?, merged = 1 "
+                "WHERE custom_id = ? AND merged = 0",
+                (response, error, custom_id)
+            ).rowcount
+            self.conn.commit()
+        return claimed == 1
+
+
+chat_batches: ChatBatchStore
 
 
 def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> list[str]:
@@ -70,119 +858,386 @@ def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> list[st
     if len(text) < chunk_size:
         return [text]
     
-    chunks = []
-    for i in range(0, len(text), chunk_size - overlap):
-        chunk = text[i:i + chunk_size]
-        if chunk:
-            chunks.append(chunk)
-    
-    return chunks
+    # Stop once a chunk reaches the end of the text: a later start would only
+    # produce a chunk that lies entirely inside the previous one
+    step = chunk_size - overlap
+    return [text[i:i + chunk_size] for i in range(0, len(text) - overlap, step)]
+
+
+def generate_embeddings(texts: list[str], batch_size: int = 64) -> np.ndarray:
+    """
+    Embed many texts in batched forward passes.
 
+    The model lock is taken per batch_size slice rather than for the whole
+    call, so query embeds waiting on it aren't stuck behind a full upload.
+    """
+    embeddings = np.empty((len(texts), get_embedding_model().get_sentence_embedding_dimension()), dtype=np.float32)
+    for start in range(0, len(texts), batch_size):
+        with embedding_lock, torch.inference_mode():
+            # FP16 models return float16; downstream math expects float32
+            embeddings[start:start + batch_size] = get_embedding_model().encode(
+                texts[start:start + batch_size],
+                batch_size=batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+    return embeddings
 
-def generate_embedding(text: str) -> np.ndarray:
-    """Generate embedding for text, with Windows stderr workaround"""
-    if not text:
-        raise ValueError("Text cannot be empty")
+def embed_chunks(chunks: list[str]) -> np.ndarray:
+    """Embed chunks, encoding only those not already in the embedding cache"""
+    keys = [EmbeddingCache.key(chunk) for chunk in chunks]
+    cached = embedding_cache.get_many(keys)
+    missing = [i for i, key in enumerate(keys) if key not in cached]
     
-    # Windows console workaround - temporarily redirect stderr to suppress tqdm errors
-    import sys
-    old_stderr = sys.stderr
+    embeddings = np.empty((len(chunks), get_embedding_model().get_sentence_embedding_dimension()), dtype=np.float32)
+    for i, key in enumerate(keys):
+        if key in cached:
+            embeddings[i] = cached[key]
     
-    try:
-        # Redirect stderr to devnull to avoid Windows console issues with tqdm
-        sys.stderr = open(os.devnull, 'w')
-        result = embedding_model.encode(text, show_progress_bar=False, convert_to_numpy=True)
-        return result
-    finally:
-        sys.stderr.close()
-        sys.stderr = old_stderr
+    if missing:
+        new_embeddings = generate_embeddings([chunks[i] for i in missing])
+        embeddings[missing] = new_embeddings
+        embedding_cache.put_many([keys[i] for i in missing], new_embeddings)
+    
+    return embeddings
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent single-text embedding requests into one encode call.
+
+    A background worker takes every request queued while the previous encode
+    was running, encodes the distinct texts together in the threadpool and
+    resolves each caller's future. A lone request is encoded immediately.
+    """
+
+    def __init__(self, max_batch: int = 32):
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+        self.worker = None
+
+    def start(self) -> None:
+        self.worker = asyncio.create_task(self.run())
 
-def calculate_similarity(embedding1: np.ndarray, embedding2: np.ndarray) -> float:
-    return 1 - scipy.spatial.distance.cosine(embedding1, embedding2)
+    async def stop(self) -> None:
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    async def embed(self, text: str) -> np.ndarray:
+        if not text:
+            raise ValueError("Text cannot be empty")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def run(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                embeddings = await run_in_threadpool(generate_embeddings, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            by_text = dict(zip(texts, embeddings))
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(by_text[text])
+
+
+embedding_batcher = EmbeddingBatcher()
+
+# Fixed prompts (like the quiz retrieval queries) embedded once per worker
+fixed_query_embeddings = OrderedDict()
+
+async def embed_fixed_query(text: str) -> np.ndarray:
+    """Embed a query string that recurs verbatim, reusing earlier results."""
+    embedding = fixed_query_embeddings.get(text)
+    if embedding is not None:
+        fixed_query_embeddings.move_to_end(text)
+        return embedding
+    embedding = await embedding_batcher.embed(text)
+    fixed_query_embeddings[text] = embedding
+    while len(fixed_query_embeddings) > FIXED_QUERY_CACHE_SIZE:
+        fixed_query_embeddings.popitem(last=False)
+    return embedding
+
+def normalize_question(question: str) -> str:
+    """Fold case, Unicode forms, whitespace and trailing punctuation so trivial edits share a key."""
+    question = unicodedata.normalize("NFKC", question).casefold()
+    return re.sub(r"\s+", " ", question).strip(" .!?")
+
+
+class SemanticCache:
+    """
+    In-process cache of Claude answers keyed by question embedding.
+
+    Entries are grouped by scope (general chat, a single document, or all
+    documents) so an answer is only reused for the same context. Questions
+    that match after normalize_question() hit without computing an
+    embedding. Oldest entries are evicted once max_entries is reached.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (scope, normalized question) -> (normalized float16 embedding, result)
+
+    def lookup_exact(self, scope: tuple, question: str) -> Optional[dict]:
+        key = (scope, normalize_question(question))
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key][1]
+
+    def lookup(self, scope: tuple, embedding: np.ndarray) -> Optional[dict]:
+        keys = [key for key in self.entries if key[0] == scope]
+        if not keys:
+            return None
+        matrix = np.stack([self.entries[key][0] for key in keys]).astype(np.float32)
+        scores = matrix @ (embedding / np.linalg.norm(embedding))
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        self.entries.move_to_end(keys[best])
+        return self.entries[keys[best]][1]
+
+    def insert(self, scope: tuple, question: str, embedding: np.ndarray, result: dict) -> None:
+        key = (scope, normalize_question(question))
+        self.entries[key] = ((embedding / np.linalg.norm(embedding)).astype(np.float16), result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate_document(self, document_name: str) -> None:
+        """Drop answers that may have been built from this document."""
+        stale_scopes = {("document", document_name), ("all",)}
+        for key in [key for key in self.entries if key[0] in stale_scopes]:
+            del self.entries[key]
+
+
+response_cache = SemanticCache()
+
+def invalidate_document_caches(document_name: str) -> None:
+    """Forget cached answers and session contexts that may include this document."""
+    response_cache.invalidate_document(document_name)
+    session_contexts.invalidate_scopes({("document", document_name), ("all",)})
+
+# Library state this worker's answer and context caches were last checked
+# against; uploads and deletes on other workers only show up in the database
+library_snapshot = {"version": None, "digests": {}}
+
+async def sync_library_caches() -> None:
+    """
+    Invalidate this worker's cached answers and session contexts for every
+    document added, replaced or deleted (by any worker) since the last call.
+    Costs one small read when the library hasn't changed.
+    """
+    version = await run_in_threadpool(uploaded_documents.version)
+    if version == library_snapshot["version"]:
+        return
+    digests = await run_in_threadpool(uploaded_documents.digests)
+    previous = library_snapshot["digests"]
+    for document_name in previous.keys() | digests.keys():
+        if previous.get(document_name) != digests.get(document_name):
+            invalidate_document_caches(document_name)
+    library_snapshot["version"] = version
+    library_snapshot["digests"] = digests
+
+def with_cache_breakpoint(messages: list[dict]) -> list[dict]:
+    """
+    Return a copy of messages with an ephemeral cache_control breakpoint on
+    the last message, so the conversation prefix is served from Anthropic's
+    prompt cache on the next turn.
+    """
+    if not messages:
+        return messages
+    cached_messages = messages[:-1]
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    else:
+        content = [dict(block) for block in content]
+    content[-1]["cache_control"] = {"type": "ephemeral"}
+    cached_messages.append({"role": last["role"], "content": content})
+    return cached_messages
+
+def find_relevant_chunk_indices(
+    question_embedding: np.ndarray,
+    chunk_embeddings: np.ndarray,
+    top_k: int = 3,
+    scales: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Row indices of the top_k embeddings by cosine similarity to the question,
+    best first.
+
+    chunk_embeddings rows are L2-normalized at upload, so one matrix-vector
+    product gives every chunk's cosine score. With scales, chunk_embeddings
+    is the int8 matrix from quantize_embeddings; it is scored a block of rows
+    at a time so only a small float32 copy ever exists.
+    """
+    if len(chunk_embeddings) == 0:
+        return np.empty(0, dtype=np.intp)
+    query = question_embedding / np.linalg.norm(question_embedding)
+    if scales is None:
+        scores = np.asarray(chunk_embeddings, dtype=np.float32) @ query
+    else:
+        scores = np.empty(len(chunk_embeddings), dtype=np.float32)
+        for start in range(0, len(chunk_embeddings), SCORE_BLOCK_ROWS):
+            block = chunk_embeddings[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + SCORE_BLOCK_ROWS] = block.astype(np.float32) @ query
+        scores *= scales
+
+    k = min(top_k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
 
 def find_relevant_chunks_semantic(
     question_embedding: np.ndarray,
-    chunk_embeddings: list[np.ndarray],
+    chunk_embeddings: np.ndarray,
     chunks: list[str],
-    top_k: int = 3
+    top_k: int = 3,
+    scales: Optional[np.ndarray] = None
 ) -> list[str]:
-    top_chunks = []
-    for chunk_embedding, chunk in zip(chunk_embeddings, chunks):
-        score = calculate_similarity(question_embedding, chunk_embedding)
-        top_chunks.append((score, chunk))
-
-    top_chunks.sort(reverse=True)
-    top_chunks = top_chunks[:top_k]
-
-    return [chunk for score, chunk in top_chunks]
+    """Return the top_k chunks by cosine similarity to the question."""
+    if len(chunks) == 0:
+        return []
+    return [chunks[i] for i in find_relevant_chunk_indices(question_embedding, chunk_embeddings, top_k, scales)]
 
-def get_document_embeddings(document_name: str) -> list[np.ndarray]:
+def get_document_embeddings(document_name: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    A document's chunk embeddings as stored: the int8 (num_chunks, dim)
+    matrix and its per-row scales, for find_relevant_chunk_indices to score
+    without dequantizing the whole document
+    """
     doc = uploaded_documents[document_name]
-    if isinstance(doc, dict) and "embeddings" in doc:
-        return doc["embeddings"]
-    return []
+    return doc["embeddings"], doc["embedding_scales"]
+
+# Stacked corpus for all-documents retrieval, rebuilt only when the library
+# version changes. Rebuilt in worker threads, one at a time.
+all_documents_cache = {"version": None, "data": None}
+all_documents_lock = threading.Lock()
 
 def collect_all_document_data():
     """
     Collect all chunks, embeddings, and sources from all uploaded documents.
+    The result is cached until a document is added, replaced or removed (on
+    any worker), so callers must not modify it.
     
     Returns:
-        tuple: (all_chunks, all_embeddings, all_sources)
+        tuple: (all_chunks, all_embeddings, all_scales, embedded_rows, all_sources, all_chunk_words)
+        where all_embeddings is one stacked int8 matrix (kept quantized, like
+        the store) with per-row all_scales, and its row j embeds
+        all_chunks[embedded_rows[j]]. Documents stored without a full set of
+        embeddings contribute no rows.
     """
+    with all_documents_lock:
+        # Read the version before the documents: a change racing the rebuild
+        # then just triggers another rebuild on the next call
+        version = uploaded_documents.version()
+        if all_documents_cache["version"] != version:
+            all_documents_cache["data"] = build_all_document_data()
+            all_documents_cache["version"] = version
+        return all_documents_cache["data"]
+
+def build_all_document_data():
+    
     all_chunks = []
-    all_embeddings = []
     all_sources = []
+    all_chunk_words = []
+    embedding_blocks = []
+    scale_blocks = []
+    embedded_rows = []
     
-    # Edge case: Empty uploaded_documents
-    if not uploaded_documents:
-        return all_chunks, all_embeddings, all_sources
-    
-    # Iterate through all documents
     for document_name in uploaded_documents.keys():
-        chunks = get_document_chunks(document_name)
-        embeddings = get_document_embeddings(document_name)
-        
-        # Add chunks, embeddings, and sources
-        for i, chunk in enumerate(chunks):
-            all_chunks.append(chunk)
-            all_sources.append(document_name)
-            # Add embedding if available, otherwise empty list element
-            if i < len(embeddings):
-                all_embeddings.append(embeddings[i])
-            else:
-                all_embeddings.append(None)
+        try:
+            # Checked against the stored digest, so never a stale hot copy
+            doc = uploaded_documents[document_name]
+        except KeyError:
+            continue  # Deleted since keys() was read
+        chunks = doc["chunks"]
+        if len(doc["embeddings"]) == len(chunks):
+            embedding_blocks.append(doc["embeddings"])
+            scale_blocks.append(doc["embedding_scales"])
+            embedded_rows.append(np.arange(len(all_chunks), len(all_chunks) + len(chunks)))
+        all_chunks.extend(chunks)
+        all_sources.extend([document_name] * len(chunks))
+        if "chunk_words" not in doc:
+            doc["chunk_words"] = [tokenize_words(chunk) for chunk in chunks]
+        all_chunk_words.extend(doc["chunk_words"])
+    
+    if embedding_blocks:
+        all_embeddings = np.vstack(embedding_blocks)
+        all_scales = np.concatenate(scale_blocks)
+        embedded_rows = np.concatenate(embedded_rows)
+    else:
+        all_embeddings = np.empty((0, get_embedding_model().get_sentence_embedding_dimension()), dtype=np.int8)
+        all_scales = np.empty(0, dtype=np.float32)
+        embedded_rows = np.empty(0, dtype=np.intp)
     
-    return all_chunks, all_embeddings, all_sources
+    return (all_chunks, all_embeddings, all_scales, embedded_rows, all_sources, all_chunk_words)
     
 def get_document_chunks(document_name: str) -> list[str]:
+    """Get the text chunks of a stored document."""
+    return uploaded_documents[document_name]["chunks"]
+
+def tokenize_words(text: str) -> frozenset[str]:
+    return frozenset(WORD_RE.findall(text.lower()))
+
+def get_document_chunk_words(document_name: str) -> list[frozenset[str]]:
     """
-    Get chunks from a document with backward compatibility.
+    Word sets of a document's chunks, tokenized once per loaded document and
+    kept on the in-memory document (not persisted to the store).
     """
     doc = uploaded_documents[document_name]
-    if isinstance(doc, dict):
-        return doc["chunks"]
-    return [doc]
+    if "chunk_words" not in doc:
+        doc["chunk_words"] = [tokenize_words(chunk) for chunk in get_document_chunks(document_name)]
+    return doc["chunk_words"]
 
-def find_relevant_chunks(question: str, chunks: list[str], top_k: int = 3) -> list[str]:
-    if not chunks:
-        return []
-    
-    # Convert question to lowercase words
-    question_words = set(question.lower().split())
+def find_relevant_chunk_indices_keyword(
+    question: str,
+    chunk_words: list[frozenset[str]],
+    top_k: int = 3
+) -> np.ndarray:
+    """Indices of the top_k chunks by question-word overlap, best first"""
+    if not chunk_words:
+        return np.empty(0, dtype=np.intp)
+    question_words = tokenize_words(question)
     
-    # Score each chunk
-    scored_chunks = []
-    for chunk in chunks:
-        chunk_words = set(chunk.lower().split())
-        # Count how many question words appear in this chunk
-        score = len(question_words & chunk_words)
-        scored_chunks.append((score, chunk))
+    # Score each chunk by how many question words appear in it
+    scores = np.fromiter(
+        (len(question_words & words) for words in chunk_words),
+        dtype=np.int32,
+        count=len(chunk_words)
+    )
     
-    # Sort by score (highest first)
-    scored_chunks.sort(reverse=True, key=lambda x: x[0])
+    # Select the top K (or all if fewer than K) without sorting every chunk;
+    # ties keep document order
+    k = min(top_k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.lexsort((top, -scores[top]))]
+
+def find_relevant_chunks(
+    question: str,
+    chunks: list[str],
+    top_k: int = 3,
+    chunk_words: Optional[list[frozenset[str]]] = None
+) -> list[str]:
+    if not chunks:
+        return []
     
-    # Return top K chunks (or all if fewer than K)
-    return [chunk for _, chunk in scored_chunks[:top_k]]
+    if chunk_words is None:
+        chunk_words = [tokenize_words(chunk) for chunk in chunks]
+    return [chunks[i] for i in find_relevant_chunk_indices_keyword(question, chunk_words, top_k)]
 
 class QuizRequest(BaseModel):
     num_questions: int
@@ -211,11 +1266,58 @@ class QuizRequest(BaseModel):
             raise ValueError("Cannot specify both document_name and use_all_documents. Use one or the other.")
         return self
 
+@app.on_event("startup")
+def open_stores():
+    global uploaded_documents, embedding_cache, conversations, chat_batches
+    uploaded_documents = DocumentStore()
+    embedding_cache = EmbeddingCache()
+    conversations = ConversationStore()
+    chat_batches = ChatBatchStore()
+
+@app.on_event("startup")
+async def load_embedding_model():
+    # Load (and on first run download) the model before taking traffic
+    await run_in_threadpool(get_embedding_model)
+
+@app.on_event("startup")
+async def start_embedding_batcher():
+    embedding_batcher.start()
+
+@app.on_event("startup")
+async def widen_threadpool():
+    # run_in_threadpool shares anyio's default 40-thread limiter; raise it so
+    # several uploads can extract and embed without queueing behind each other
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+@app.on_event("shutdown")
+async def close_client():
+    await client.close()
+
+@app.on_event("shutdown")
+async def stop_embedding_batcher():
+    await embedding_batcher.stop()
+
+@app.on_event("shutdown")
+def stop_log_listener():
+    # Flushes any queued records
+    log_listener.stop()
+
+@app.on_event("shutdown")
+def close_stores():
+    for store in (uploaded_documents, embedding_cache, conversations, chat_batches):
+        store.conn.close()
+
+@app.on_event("shutdown")
+def stop_pdf_workers():
+    # pdf_extraction is imported lazily, so only shut it down if it was used
+    if "pdf_extraction" in sys.modules:
+        sys.modules["pdf_extraction"].shutdown()
+
 @app.post("/generate-quiz")
 async def generate_quiz(request: QuizRequest):
 
     if request.use_all_documents:
-        all_chunks, all_embeddings, all_sources = collect_all_document_data()
+        all_chunks, all_embeddings, all_scales, embedded_rows, _, _ = await run_in_threadpool(collect_all_document_data)
         if not all_chunks:
             raise HTTPException(
                 status_code=400,
@@ -225,7 +1327,7 @@ async def generate_quiz(request: QuizRequest):
                 }
             )
         # For all documents, use general quiz embedding
-        quiz_embedding = generate_embedding("key concepts for quiz on all documents")
+        quiz_embedding = await embed_fixed_query("key concepts for quiz on all documents")
     else:
         if not request.document_name:
             raise HTTPException(
@@ -236,17 +1338,18 @@ async def generate_quiz(request: QuizRequest):
                 }
             )
         # Validate document exists
-        if request.document_name not in uploaded_documents:
+        if not await run_in_threadpool(uploaded_documents.__contains__, request.document_name):
             raise HTTPException(
                 status_code=404,
                 detail={
                     "error": "DocumentNotFound",
                     "message": f"Document '{request.document_name}' not found.",
-                    "available": list(uploaded_documents.keys())
+                    "available": await run_in_threadpool(uploaded_documents.keys)
                 }
             )
-        all_chunks = get_document_chunks(request.document_name)
-        all_embeddings = get_document_embeddings(request.document_name)
+        all_chunks = await run_in_threadpool(get_document_chunks, request.document_name)
+        all_embeddings, all_scales = await run_in_threadpool(get_document_embeddings, request.document_name)
+        embedded_rows = np.arange(len(all_embeddings))
         if not all_chunks:
             raise HTTPException(
                 status_code=400,
@@ -256,7 +1359,7 @@ async def generate_quiz(request: QuizRequest):
                 }
             )
         # For single document, use document-specific embedding
-        quiz_embedding = generate_embedding(f"key concepts for quiz on {request.document_name}")
+        quiz_embedding = await embed_fixed_query(f"key concepts for quiz on {request.document_name}")
     
     # Dynamic top_k based on number of questions (more questions = more context needed)
     # Use at least 5 chunks, up to 15 for larger quizzes
@@ -264,7 +1367,8 @@ async def generate_quiz(request: QuizRequest):
     
     # Use semantic search if embeddings available, otherwise use first chunks
     if len(all_embeddings) > 0:
-        relevant_chunks = find_relevant_chunks_semantic(quiz_embedding, all_embeddings, all_chunks, top_k=top_k)
+        top = find_relevant_chunk_indices(quiz_embedding, all_embeddings, top_k=top_k, scales=all_scales)
+        relevant_chunks = [all_chunks[i] for i in embedded_rows[top]]
     else:
         relevant_chunks = all_chunks[:top_k]  # Fallback to first chunks
     
@@ -345,7 +1449,7 @@ DO NOT include markdown code fences or any other formatting.
 Return raw JSON only."""
     
     try:
-        response = client.messages.create(
+        response = await create_message(
             model="claude-3-5-haiku-20241022",
             max_tokens=4096,
             messages=[{"role": "user", "content": prompt}]
@@ -363,25 +1467,19 @@ Return raw JSON only."""
     
     raw_response_text = response.content[0].text
     
-    # Extract JSON from response (handle markdown code fences)
-    if raw_response_text.startswith("```json"):
-        raw_response_text = raw_response_text[len("```json"):].strip()
-    elif raw_response_text.startswith("```"):
-        raw_response_text = raw_response_text[len("```"):].strip()
-    
-    if raw_response_text.endswith("```"):
-        raw_response_text = raw_response_text[:-len("```")].strip()
-    
-    # Try to extract JSON using regex if there's extra text
-    json_match = re.search(r'\{.*\}', raw_response_text, re.DOTALL)
-    if json_match:
-        json_str = json_match.group(0)
+    # The quiz is the outermost {...} in the reply, which also skips any
+    # markdown code fence or text around it (same span as a greedy
+    # \{.*\} match, found with two string scans)
+    start = raw_response_text.find("{")
+    end = raw_response_text.rfind("}")
+    if start != -1 and end > start:
+        json_str = raw_response_text[start:end + 1]
     else:
         json_str = raw_response_text
     
-    # Parse JSON
+    # Parse JSON (orjson's error type subclasses json.JSONDecodeError)
     try:
-        quiz_data = json.loads(json_str)
+        quiz_data = orjson.loads(json_str)
     except json.JSONDecodeError as e:
         logger.error(f"Failed to parse quiz JSON: {e}")
         raise HTTPException(
@@ -452,37 +1550,15 @@ Return raw JSON only."""
         "questions": quiz_data["questions"]
     }
 
+# Stripped and checked for emptiness by pydantic-core, not a Python validator
+NonEmptyStr = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]
+
+
 class ChatRequest(BaseModel):
-    message: str
-    document_name: Optional[str] = None
+    message: NonEmptyStr
+    document_name: Optional[NonEmptyStr] = None
     use_all_documents: Optional[bool] = False
-    session_id: Optional[str] = None
-    
-    @field_validator('message')
-    @classmethod
-    def validate_message(cls, v: str) -> str:
-        if not v or not v.strip():
-            raise ValueError("Message cannot be empty or whitespace only")
-        return v.strip()
-    
-    @field_validator('document_name')
-    @classmethod
-    def validate_document_name(cls, v: Optional[str]) -> Optional[str]:
-        # Only validate if document_name is provided (not None)
-        if v is not None:
-            v = v.strip()
-            if not v:
-                raise ValueError("Document name cannot be empty or whitespace only")
-        return v
-
-    @field_validator('session_id')
-    @classmethod
-    def validate_session_id(cls, v: Optional[str]) -> Optional[str]:
-        if v is not None:
-            v = v.strip()
-            if not v:
-                raise ValueError("Session ID cannot be empty")
-        return v
+    session_id: Optional[NonEmptyStr] = None
     
     @model_validator(mode='after')
     def validate_document_options(self):
@@ -492,185 +1568,256 @@ class ChatRequest(BaseModel):
         return self
 
 
-@app.post("/chat")
-def chat(request: ChatRequest):
-    try:
-        # Get or create session
-        session_id = request.session_id or "default"
-        
-        if session_id not in conversations:
-            conversations[session_id] = []
-        
-        # Build user message (with document if specified)
-        user_message = request.message
+async def prepare_chat_turn(request: ChatRequest) -> dict:
+    """
+    Resolve everything a chat turn needs before calling Claude: the session
+    history, a cached answer if one applies, and the retrieved document
+    context as a cached system block.
+
+    Returns:
+        A dict whose "cached_response" is the finished response on a cache
+        hit; otherwise the turn state the Claude call and finish_chat_turn use.
+    """
+    session_id = request.session_id or "default"
+    
+    # The stores are SQLite: every read and write runs in a worker thread so a
+    # busy database never blocks the event loop
+    history = await run_in_threadpool(conversations.get, session_id)
+    if history is None:
+        history = ChatHistory()
+    
+    # Initialize metadata tracking
+    documents_used = []
+    chunk_sources = []
+    question_embedding = None
+    # Retrieved document sections go in a cached system block, not the user turn
+    system_prompt = None
+    
+    # Drop answers and contexts built from documents that changed elsewhere,
+    # and never answer from the cache for a document that no longer exists
+    await sync_library_caches()
+    if request.document_name and not await run_in_threadpool(uploaded_documents.__contains__, request.document_name):
+        available = await run_in_threadpool(uploaded_documents.keys)
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "DocumentNotFound",
+                "message": f"Document '{request.document_name}' not found.",
+                "detail": f"Available: {available}"
+            }
+        )
+    
+    if request.document_name:
+        cache_scope = ("document", request.document_name)
+    elif request.use_all_documents:
+        cache_scope = ("all",)
+    else:
+        cache_scope = ("general",)
+    
+    # Cached answers are only valid without prior conversation context
+    use_cache = not history
+    if use_cache:
+        cached = response_cache.lookup_exact(cache_scope, request.message)
+        if cached is None:
+            question_embedding = await embedding_batcher.embed(request.message)
+            cached = response_cache.lookup(cache_scope, question_embedding)
+        if cached is not None:
+            history.append({"role": "user", "content": request.message})
+            history.append({"role": "assistant", "content": cached["response"]})
+            await run_in_threadpool(conversations.save, session_id, history)
+            return {
+                "cached_response": {
+                    "response": cached["response"],
+                    "session_id": session_id,
+                    "message_count": len(history),
+                    "documents_used": cached["documents_used"],
+                    "chunk_sources": cached["chunk_sources"],
+                    "cached": True
+                }
+            }
+    
+    if request.document_name or request.use_all_documents:
+        if question_embedding is None:
+            question_embedding = await embedding_batcher.embed(request.message)
+        # Reuse this session's retrieved sections while the question stays on
+        # topic, so the system prefix is byte-identical and hits the prompt cache
+        context = session_contexts.get(session_id)
+        if (
+            context
+            and context["scope"] == cache_scope
+            and float(context["anchor"] @ question_embedding) >= CONTEXT_REUSE_THRESHOLD
+        ):
+            system_prompt = context["system_prompt"]
+            documents_used = context["documents_used"]
+            chunk_sources = context["chunk_sources"]
+    
+    reused_context = system_prompt is not None
+    
+    if not reused_context and request.document_name:
+        # Single document mode (existence was checked above)
+        all_chunks = await run_in_threadpool(get_document_chunks, request.document_name)
+        all_embeddings, all_scales = await run_in_threadpool(get_document_embeddings, request.document_name)
         
-        # Initialize metadata tracking
-        documents_used = []
-        chunk_sources = []
+        # Edge case: Document has no chunks
+        if not all_chunks:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "error": "EmptyDocument",
+                    "message": f"Document '{request.document_name}' has no chunks.",
+                }
+            )
         
-        if request.document_name:
-            # Single document mode
-            if request.document_name not in uploaded_documents:
-                raise HTTPException(
-                    status_code=404,
-                    detail={
-                        "error": "DocumentNotFound",
-                        "message": f"Document '{request.document_name}' not found.",
-                        "detail": f"Available: {list(uploaded_documents.keys())}"
-                    }
-                )
-            all_chunks = get_document_chunks(request.document_name)
-            all_embeddings = get_document_embeddings(request.document_name)
-            
-            # Edge case: Document has no chunks
-            if not all_chunks:
-                raise HTTPException(
-                    status_code=400,
-                    detail={
-                        "error": "EmptyDocument",
-                        "message": f"Document '{request.document_name}' has no chunks.",
-                    }
-                )
-            
-            if len(all_embeddings) > 0:
-                question_embedding = generate_embedding(request.message)
-                relevant_chunks = find_relevant_chunks_semantic(question_embedding, all_embeddings, all_chunks)
-            else:
-                relevant_chunks = find_relevant_chunks(request.message, all_chunks)
+        if len(all_embeddings) > 0:
+            relevant_chunks = find_relevant_chunks_semantic(
+                question_embedding, all_embeddings, all_chunks, scales=all_scales
+            )
+        else:
+            chunk_words = await run_in_threadpool(get_document_chunk_words, request.document_name)
+            relevant_chunks = find_relevant_chunks(request.message, all_chunks, chunk_words=chunk_words)
 
-            # Fallback: If no relevant chunks found, use all chunks
-            if not relevant_chunks:
-                relevant_chunks = all_chunks
+        # Fallback: If no relevant chunks found, use all chunks
+        if not relevant_chunks:
+            relevant_chunks = all_chunks
 
-            # Track metadata for single document mode
-            documents_used = [request.document_name]
-            chunk_sources = [request.document_name] * len(relevant_chunks)
+        # Track metadata for single document mode
+        documents_used = [request.document_name]
+        chunk_sources = [request.document_name] * len(relevant_chunks)
 
-            combined_text = "\n\n---\n\n".join(relevant_chunks)
-            
-            # Edge case: Empty combined_text (shouldn't happen due to check above, but safety check)
-            if not combined_text:
-                combined_text = "No relevant content found in document."
-            
-            user_message = f"""Here are sections from the document:
+        combined_text = "\n\n---\n\n".join(relevant_chunks)
+        
+        # Edge case: Empty combined_text (shouldn't happen due to check above, but safety check)
+        if not combined_text:
+            combined_text = "No relevant content found in document."
+        
+        system_prompt = f"""Here are sections from the document:
 {combined_text}
 
-Based on these sections, answer: {request.message}
-
-If not in document, say so."""
-                    
-        elif request.use_all_documents:
-            # All documents mode - collect all documents (with or without embeddings)
-            all_chunks, all_embeddings, all_sources = collect_all_document_data()
-            
-            # Collect chunks from ALL documents (not just those with embeddings)
-            if not uploaded_documents:
-                raise HTTPException(
-                    status_code=400,
-                    detail={
-                        "error": "NoDocuments",
-                        "message": "No documents uploaded. Please upload documents first.",
-                    }
-                )
-            
-            # Edge case: No chunks found in any document
-            if not all_chunks:
-                raise HTTPException(
-                    status_code=400,
-                    detail={
-                        "error": "NoChunks",
-                        "message": "No document chunks found. Documents may be empty.",
-                    }
-                )
-            
-            # Filter out None embeddings and track which chunks have embeddings
-            chunks_with_embeddings = []
-            embeddings_filtered = []
-            sources_with_embeddings = []
-            
-            for chunk, embedding, source in zip(all_chunks, all_embeddings, all_sources):
-                if embedding is not None:
-                    chunks_with_embeddings.append(chunk)
-                    embeddings_filtered.append(embedding)
-                    sources_with_embeddings.append(source)
-            
-            # Use semantic search if we have embeddings, otherwise keyword search
-            if len(embeddings_filtered) > 0:
-                question_embedding = generate_embedding(request.message)
-                relevant_chunks = find_relevant_chunks_semantic(question_embedding, embeddings_filtered, chunks_with_embeddings)
-                # Get sources for the relevant chunks
-                relevant_sources = []
-                for chunk in relevant_chunks:
-                    try:
-                        idx = chunks_with_embeddings.index(chunk)
-                        relevant_sources.append(sources_with_embeddings[idx])
-                    except ValueError:
-                        relevant_sources.append("unknown")
-            else:
-                # No embeddings available, use keyword search
-                relevant_chunks = find_relevant_chunks(request.message, all_chunks)
-                if not relevant_chunks:
-                    relevant_chunks = all_chunks[:10]  # Limit to first 10 chunks if no matches
-                
+Answer the user's questions based on these sections. If the answer is not in the document, say so."""
                 
-            chunk_to_source = dict(zip(all_chunks, all_sources))
-
-            # Lookup
-            relevant_sources = [chunk_to_source.get(chunk, "unknown") for chunk in relevant_chunks]
-            
-            # Edge case: Ensure we have sources for all chunks
-            if len(relevant_sources) != len(relevant_chunks):
-                while len(relevant_sources) < len(relevant_chunks):
-                    relevant_sources.append("unknown")
-            
-            # Format chunks with sources
-            formatted_chunks = []
-            for chunk, source in zip(relevant_chunks, relevant_sources):
-                formatted_chunks.append(f"Source: {source}\n--------------------------------\n{chunk}")
-            
-            combined_text = "\n\n---\n\n".join(formatted_chunks)
-            
-            # Track metadata for all documents mode
-            chunk_sources = relevant_sources
-            documents_used = list(set(relevant_sources))  # Get unique document names
-            
-            user_message = f"""Here are sections from the documents:
-{combined_text}
-
-Based on these sections, answer: {request.message}
-
-If not in documents, say so."""
-                    
-        # Build message history for Claude
-        # Copy existing history and add new message
-        message_history = conversations[session_id].copy()
-        message_history.append({"role": "user", "content": user_message})
-        
-        # Send to Claude with full conversation context
-        response = client.messages.create(
-            model="claude-3-5-haiku-20241022",
-            max_tokens=4096,
-            messages=message_history
+    elif not reused_context and request.use_all_documents:
+        # All documents mode - collect all documents (with or without embeddings)
+        all_chunks, all_embeddings, all_scales, embedded_rows, all_sources, all_chunk_words = (
+            await run_in_threadpool(collect_all_document_data)
         )
         
-        assistant_message = response.content[0].text
+        # Collect chunks from ALL documents (not just those with embeddings)
+        if not all_chunks and not await run_in_threadpool(len, uploaded_documents):
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "error": "NoDocuments",
+                    "message": "No documents uploaded. Please upload documents first.",
+                }
+            )
+        
+        # Edge case: No chunks found in any document
+        if not all_chunks:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "error": "NoChunks",
+                    "message": "No document chunks found. Documents may be empty.",
+                }
+            )
         
-        # Save conversation (both user and assistant messages)
-        conversations[session_id].append({"role": "user", "content": user_message})
-        conversations[session_id].append({"role": "assistant", "content": assistant_message})
+        # Pick chunks by position so each one's source is a direct lookup; use
+        # semantic search if we have embeddings, otherwise keyword search
+        if len(all_embeddings) > 0:
+            top = embedded_rows[find_relevant_chunk_indices(question_embedding, all_embeddings, scales=all_scales)]
+        else:
+            top = find_relevant_chunk_indices_keyword(request.message, all_chunk_words)
         
-        return {
-            "response": assistant_message,
-            "session_id": session_id,
-            "message_count": len(conversations[session_id]),
+        relevant_chunks = [all_chunks[i] for i in top]
+        relevant_sources = [all_sources[i] for i in top]
+        
+        # Format chunks with sources, in a single join with no intermediate list
+        combined_text = "\n\n---\n\n".join(
+            f"Source: {source}\n--------------------------------\n{chunk}"
+            for chunk, source in zip(relevant_chunks, relevant_sources)
+        )
+        
+        # Track metadata for all documents mode
+        chunk_sources = relevant_sources
+        documents_used = list(set(relevant_sources))  # Get unique document names
+        
+        system_prompt = f"""Here are sections from the documents:
+{combined_text}
+
+Answer the user's questions based on these sections. If the answer is not in the documents, say so."""
+    
+    if system_prompt is not None and not reused_context:
+        session_contexts.put(session_id, {
+            "scope": cache_scope,
+            "anchor": question_embedding,
+            "system_prompt": system_prompt,
             "documents_used": documents_used,
             "chunk_sources": chunk_sources
-        }
+        })
+                
+    request_kwargs = {}
+    if system_prompt is not None:
+        request_kwargs["system"] = [
+            {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}
+        ]
     
-    except HTTPException:
-        raise
-    except AuthenticationError as e:
-        raise HTTPException(
+    return {
+        "cached_response": None,
+        "session_id": session_id,
+        "history": history,
+        "cache_scope": cache_scope,
+        "use_cache": use_cache,
+        "question_embedding": question_embedding,
+        "documents_used": documents_used,
+        "chunk_sources": chunk_sources,
+        "request_kwargs": request_kwargs
+    }
+
+
+# session_id -> lock serializing that session's turns in this worker; entries
+# disappear once no request holds the lock. Workers don't share these locks,
+# so two turns of one session racing on different workers can each save
+# their own history and the later save wins.
+session_locks = weakref.WeakValueDictionary()
+
+
+def session_lock(session_id: str) -> asyncio.Lock:
+    lock = session_locks.get(session_id)
+    if lock is None:
+        lock = session_locks[session_id] = asyncio.Lock()
+    return lock
+
+
+def usage_tokens(usage) -> int:
+    """Every token a Claude call used: input (cached or not) plus output"""
+    return (
+        (getattr(usage, "input_tokens", None) or 0)
+        + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+        + (getattr(usage, "cache_read_input_tokens", None) or 0)
+        + (getattr(usage, "output_tokens", None) or 0)
+    )
+
+
+async def finish_chat_turn(request: ChatRequest, turn: dict, assistant_message: str, usage) -> None:
+    """Save the assistant reply with its user turn and cache first-turn answers"""
+    turn["history"].append({"role": "assistant", "content": assistant_message})
+    turn["history"].token_count += usage_tokens(usage)
+    await run_in_threadpool(conversations.save, turn["session_id"], turn["history"])
+    
+    if turn["use_cache"]:
+        response_cache.insert(turn["cache_scope"], request.message, turn["question_embedding"], {
+            "response": assistant_message,
+            "documents_used": turn["documents_used"],
+            "chunk_sources": turn["chunk_sources"]
+        })
+
+
+def chat_http_error(e: Exception) -> HTTPException:
+    """Map an Anthropic (or unexpected) error to the HTTPException /chat returns"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, AuthenticationError):
+        return HTTPException(
             status_code=401,
             detail={
                 "error": "AuthenticationError",
@@ -678,8 +1825,8 @@ If not in documents, say so."""
                 "detail": str(e)
             }
         )
-    except RateLimitError as e:
-        raise HTTPException(
+    elif isinstance(e, RateLimitError):
+        return HTTPException(
             status_code=429,
             detail={
                 "error": "RateLimitError",
@@ -687,8 +1834,8 @@ If not in documents, say so."""
                 "detail": str(e)
             }
         )
-    except APIConnectionError as e:
-        raise HTTPException(
+    elif isinstance(e, APIConnectionError):
+        return HTTPException(
             status_code=503,
             detail={
                 "error": "APIConnectionError",
@@ -696,8 +1843,8 @@ If not in documents, say so."""
                 "detail": str(e)
             }
         )
-    except BadRequestError as e:
-        raise HTTPException(
+    elif isinstance(e, BadRequestError):
+        return HTTPException(
             status_code=400,
             detail={
                 "error": "BadRequestError",
@@ -705,8 +1852,8 @@ If not in documents, say so."""
                 "detail": str(e)
             }
         )
-    except InternalServerError as e:
-        raise HTTPException(
+    elif isinstance(e, InternalServerError):
+        return HTTPException(
             status_code=503,
             detail={
                 "error": "InternalServerError",
@@ -714,9 +1861,9 @@ If not in documents, say so."""
                 "detail": str(e)
             }
         )
-    except APIStatusError as e:
+    elif isinstance(e, APIStatusError):
         status_code = e.status_code if hasattr(e, 'status_code') else 500
-        raise HTTPException(
+        return HTTPException(
             status_code=status_code,
             detail={
                 "error": "APIStatusError",
@@ -724,8 +1871,8 @@ If not in documents, say so."""
                 "detail": str(e)
             }
         )
-    except APIError as e:
-        raise HTTPException(
+    elif isinstance(e, APIError):
+        return HTTPException(
             status_code=500,
             detail={
                 "error": "APIError",
@@ -733,30 +1880,336 @@ If not in documents, say so."""
                 "detail": str(e)
             }
         )
+    try:
+        logger.error(f"Chat error: {str(e)}")
+    except:
+        pass  # Ignore logging errors on Windows
+    return HTTPException(
+        status_code=500,
+        detail={
+            "error": "InternalError",
+            "message": "An unexpected error occurred.",
+            "detail": str(e)
+        }
+    )
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    try:
+        # One turn at a time per session, so concurrent requests can't interleave
+        # their history updates
+        async with session_lock(request.session_id or "default"):
+            turn = await prepare_chat_turn(request)
+            if turn["cached_response"] is not None:
+                return turn["cached_response"]
+            history = turn["history"]
+            
+            # Append the user turn in place (no copy of the history) and roll it
+            # back if Claude doesn't answer
+            history.append({"role": "user", "content": request.message})
+            try:
+                # Send to Claude with full conversation context
+                response = await create_message(
+                    model="claude-3-5-haiku-20241022",
+                    max_tokens=4096,
+                    messages=with_cache_breakpoint(history),
+                    **turn["request_kwargs"]
+                )
+                assistant_message = response.content[0].text
+            except BaseException:
+                history.pop()
+                raise
+            
+            cache_read_tokens = getattr(response.usage, "cache_read_input_tokens", None) or 0
+            await finish_chat_turn(request, turn, assistant_message, response.usage)
+            
+            return {
+                "response": assistant_message,
+                "session_id": turn["session_id"],
+                "message_count": len(history),
+                "documents_used": turn["documents_used"],
+                "chunk_sources": turn["chunk_sources"],
+                "cached": False,
+                "cache_read_input_tokens": cache_read_tokens
+            }
+    
     except Exception as e:
+        raise chat_http_error(e)
+
+
+def sse_event(payload: dict) -> bytes:
+    """Encode one server-sent event"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Same as /chat, but streams the answer as server-sent events: one
+    {"delta": ...} event per text chunk, then a final event carrying the
+    /chat metadata. Errors before the first token are normal HTTP errors;
+    errors mid-stream arrive as an {"error": ...} event.
+    """
+    # Held until the stream finishes. The generator's finally never runs if
+    # the client disconnects before the first event is pulled, so the
+    # response's background task releases it too; release() is idempotent.
+    lock = session_lock(request.session_id or "default")
+    await lock.acquire()
+    released = False
+    
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            lock.release()
+    
+    try:
+        turn = await prepare_chat_turn(request)
+    except BaseException as e:
+        release()
+        if isinstance(e, Exception):
+            raise chat_http_error(e)
+        raise
+    
+    async def events():
         try:
-            logger.error(f"Chat error: {str(e)}")
-        except:
-            pass  # Ignore logging errors on Windows
-        raise HTTPException(
-            status_code=500,
-            detail={
-                "error": "InternalError",
-                "message": "An unexpected error occurred.",
-                "detail": str(e)
-            }
+            async for event in stream_turn():
+                yield event
+        finally:
+            release()
+    
+    async def stream_turn():
+        if turn["cached_response"] is not None:
+            yield sse_event({"delta": turn["cached_response"]["response"]})
+            yield sse_event({**turn["cached_response"], "done": True})
+            return
+        
+        history = turn["history"]
+        history.append({"role": "user", "content": request.message})
+        parts = []
+        request_kwargs = {"messages": with_cache_breakpoint(history), **turn["request_kwargs"]}
+        # The call runs as a task that hands text chunks over as they arrive;
+        # None marks its end
+        deltas = asyncio.Queue()
+        
+        async def send():
+            async with client.messages.stream(
+                model="claude-3-5-haiku-20241022",
+                max_tokens=4096,
+                **request_kwargs
+            ) as stream:
+                async for text in stream.text_stream:
+                    parts.append(text)
+                    deltas.put_nowait(text)
+                return await stream.get_final_message()
+        
+        # Only retry before anything has been sent to the client
+        call = asyncio.create_task(call_claude(send, request_kwargs, can_retry=lambda: not parts))
+        call.add_done_callback(lambda _: deltas.put_nowait(None))
+        try:
+            while (text := await deltas.get()) is not None:
+                yield sse_event({"delta": text})
+            final_message = call.result()
+        except Exception as e:
+            history.pop()
+            error = chat_http_error(e)
+            yield sse_event({"error": error.detail, "status_code": error.status_code})
+            return
+        except BaseException:
+            # Client disconnected mid-answer: drop the unanswered user turn
+            call.cancel()
+            history.pop()
+            raise
+        
+        assistant_message = "".join(parts)
+        await finish_chat_turn(request, turn, assistant_message, final_message.usage)
+        
+        yield sse_event({
+            "done": True,
+            "session_id": turn["session_id"],
+            "message_count": len(history),
+            "documents_used": turn["documents_used"],
+            "chunk_sources": turn["chunk_sources"],
+            "cached": False,
+            "cache_read_input_tokens": getattr(final_message.usage, "cache_read_input_tokens", None) or 0
+        })
+    
+    try:
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            background=BackgroundTask(release)
         )
+    except BaseException:
+        release()
+        raise
+
+@app.post("/chat/batch")
+async def chat_batch(requests: list[ChatRequest]):
+    """
+    Submit several chat turns as one Anthropic message batch (half the token
+    price, answered asynchronously). Each turn sees its session's history as
+    of submission; poll GET /chat/batch/{batch_id} to merge the answers back.
+    """
+    if not requests:
+        raise HTTPException(status_code=400, detail="At least one request is required")
+    if len(requests) > MAX_BATCH_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_REQUESTS} requests per batch")
+    
+    try:
+        rows = []
+        batch_requests = []
+        # Answers merged later only enter the answer cache if no document
+        # changed in between
+        library_version = await run_in_threadpool(uploaded_documents.version)
+        for index, request in enumerate(requests):
+            async with session_lock(request.session_id or "default"):
+                turn = await prepare_chat_turn(request)
+            custom_id = f"turn-{index}-{os.urandom(8).hex()}"
+            row = {
+                "custom_id": custom_id,
+                "session_id": turn["session_id"] if turn["cached_response"] is None else turn["cached_response"]["session_id"],
+                "message": request.message,
+                "response": None,
+                "merged": 0,
+                "cache_entry": None,
+                "question_embedding": None
+            }
+            if turn["cached_response"] is not None:
+                # Already answered and saved by the answer cache
+                row["response"] = turn["cached_response"]["response"]
+                row["merged"] = 1
+            else:
+                if turn["use_cache"]:
+                    row["cache_entry"] = orjson.dumps({
+                        "scope": turn["cache_scope"],
+                        "library_version": library_version,
+                        "documents_used": turn["documents_used"],
+                        "chunk_sources": turn["chunk_sources"]
+                    }).decode()
+                    row["question_embedding"] = turn["question_embedding"]
+                batch_requests.append({
+                    "custom_id": custom_id,
+                    "params": {
+                        "model": "claude-3-5-haiku-20241022",
+                        "max_tokens": 4096,
+                        "messages": with_cache_breakpoint(turn["history"] + [{"role": "user", "content": request.message}]),
+                        **turn["request_kwargs"]
+                    }
+                })
+            rows.append(row)
+        
+        if batch_requests:
+            async with claude_semaphore:
+                # Batch input is billed against the Message Batches limits, not
+                # the Messages API's per-minute token limit, so submitting only
+                # takes a request slot, not a token charge
+                await claude_rate_limiter.acquire()
+                batch = await client.messages.batches.create(requests=batch_requests)
+            batch_id = batch.id
+            status = batch.processing_status
+        else:
+            batch_id = f"cached-{os.urandom(8).hex()}"
+            status = "ended"
+        for row in rows:
+            row["batch_id"] = batch_id
+        await run_in_threadpool(chat_batches.add, rows)
+    except Exception as e:
+        raise chat_http_error(e)
+    
+    return {"batch_id": batch_id, "status": status, "request_count": len(rows)}
+
+
+async def merge_batch_results(batch_id: str, pending: dict) -> None:
+    """Append a finished batch's answers for the pending rows to their sessions"""
+    await sync_library_caches()
+    library_version = await run_in_threadpool(uploaded_documents.version)
+    async for entry in await client.messages.batches.results(batch_id):
+        if not pending:
+            break  # The rest of the results were merged earlier
+        row = pending.pop(entry.custom_id, None)
+        if row is None:
+            continue
+        response = error = None
+        if entry.result.type == "succeeded":
+            response = entry.result.message.content[0].text
+        else:
+            error = entry.result.type
+        if not await run_in_threadpool(chat_batches.mark_merged, entry.custom_id, response, error):
+            continue  # Another worker merged it first
+        if response is None:
+            continue
+        async with session_lock(row["session_id"]):
+            history = await run_in_threadpool(conversations.get, row["session_id"]) or ChatHistory()
+            history.append({"role": "user", "content": row["message"]})
+            history.append({"role": "assistant", "content": response})
+            history.token_count += usage_tokens(entry.result.message.usage)
+            await run_in_threadpool(conversations.save, row["session_id"], history)
+        cache_entry = row["cache_entry"]
+        if cache_entry is not None and cache_entry["library_version"] == library_version:
+            # A first-turn answer, cached like /chat's under the embedding
+            # computed at submission
+            response_cache.insert(tuple(cache_entry["scope"]), row["message"], row["question_embedding"], {
+                "response": response,
+                "documents_used": cache_entry["documents_used"],
+                "chunk_sources": cache_entry["chunk_sources"]
+            })
+
+
+@app.get("/chat/batch/{batch_id}")
+async def get_chat_batch(batch_id: str):
+    """
+    Status of a /chat/batch submission. Once Anthropic has finished it, the
+    answers are appended to their sessions (once) and returned.
+    """
+    rows = await run_in_threadpool(chat_batches.get, batch_id)
+    if not rows:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    try:
+        status = "ended"
+        if not all(row["merged"] for row in rows):
+            batch = await client.messages.batches.retrieve(batch_id)
+            status = batch.processing_status
+            if status != "ended":
+                return {
+                    "batch_id": batch_id,
+                    "status": status,
+                    "request_counts": batch.request_counts.model_dump()
+                }
+            # Saves this worker fetching the results twice at once; claiming
+            # each row in mark_merged is what merges it only once across workers
+            async with session_lock(f"batch:{batch_id}"):
+                rows = await run_in_threadpool(chat_batches.get, batch_id)
+                pending = {row["custom_id"]: row for row in rows if not row["merged"]}
+                # Nothing left to merge (e.g. another request just did it):
+                # skip reading the results back
+                if pending:
+                    await merge_batch_results(batch_id, pending)
+                    rows = await run_in_threadpool(chat_batches.get, batch_id)
+    except Exception as e:
+        raise chat_http_error(e)
+    
+    return {
+        "batch_id": batch_id,
+        "status": status,
+        "results": [
+            {key: row[key] for key in ("custom_id", "session_id", "message", "response", "error")}
+            for row in rows
+        ]
+    }
+
 
 @app.post("/summarize/{filename}")
 async def summarize_document(filename: str):
-    if filename not in uploaded_documents:
-        raise HTTPException(status_code = 404, detail = {"error": "DocumentNotFound", "message": f"Document {filename} not found", "available": list(uploaded_documents.keys())})
-    doc = uploaded_documents[filename]
-    if isinstance(doc, dict):
-        text = doc["full_text"]
-    else:
-        text = doc
-    chunks = chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
+    try:
+        doc = await run_in_threadpool(uploaded_documents.__getitem__, filename)
+    except KeyError:
+        available = await run_in_threadpool(uploaded_documents.keys)
+        raise HTTPException(status_code = 404, detail = {"error": "DocumentNotFound", "message": f"Document {filename} not found", "available": available})
+    text = doc["full_text"]
     if not text or len(text.strip()) == 0:
         raise HTTPException(
             status_code=400,
@@ -765,14 +2218,43 @@ async def summarize_document(filename: str):
                 "message": f"Document '{filename}' is empty."
             }
         )
-    MAX_TEXT_LENGTH = 50000  # ~12,500 tokens
-    if len(text) > MAX_TEXT_LENGTH:
-        text_to_summarize = text[:MAX_TEXT_LENGTH] + "\n\n[Document truncated due to length]"
-        logger.warning(f"Document {filename} truncated from {len(text)} to {MAX_TEXT_LENGTH} chars")
-    else:
-        text_to_summarize = text
-    prompt = f"""Please analyze this document and provide a comprehensive summary.
-    Document content:
+    try:
+        if len(text) > SUMMARY_SECTION_LENGTH:
+            # Long document: summarize each section concurrently (create_message
+            # bounds the concurrency), then write the final summary from those.
+            # If one section fails the task group cancels the rest.
+            sections = [
+                text[i:i + SUMMARY_SECTION_LENGTH] for i in range(0, len(text), SUMMARY_SECTION_LENGTH)
+            ]
+            if len(sections) > MAX_SUMMARY_SECTIONS:
+                logger.warning(
+                    f"Document {filename} truncated from {len(text)} to "
+                    f"{MAX_SUMMARY_SECTIONS * SUMMARY_SECTION_LENGTH} chars"
+                )
+                sections = sections[:MAX_SUMMARY_SECTIONS]
+            async with asyncio.TaskGroup() as group:
+                section_tasks = [
+                    group.create_task(create_message(
+                        model="claude-3-5-haiku-20241022",
+                        max_tokens=1000,
+                        messages=[{"role": "user", "content": (
+                            f"This is part {number} of {len(sections)} of a document. Summarize its key "
+                            f"concepts, findings, definitions and examples as concise bullet points.\n\n{section}"
+                        )}]
+                    ))
+                    for number, section in enumerate(sections, 1)
+                ]
+            text_to_summarize = "\n\n".join(
+                f"[Summary of part {number}]\n{task.result().content[0].text}"
+                for number, task in enumerate(section_tasks, 1)
+            )
+            content_label = "Summaries of consecutive parts of the document"
+        else:
+            text_to_summarize = text
+            content_label = "Document content"
+        
+        prompt = f"""Please analyze this document and provide a comprehensive summary.
+    {content_label}:
     {text_to_summarize}
 
     Provide your summary in this format:
@@ -791,9 +2273,9 @@ async def summarize_document(filename: str):
     - [Continue as needed]
 
     Keep it concise but comprehensive. Focus on the most important information a student would need to know."""
-    try:
+        
         # Step 6: Call Claude API
-        response = client.messages.create(
+        response = await create_message(
             model="claude-3-5-haiku-20241022",
             max_tokens=2000,
             messages=[{"role": "user", "content": prompt.strip()}]
@@ -811,7 +2293,13 @@ async def summarize_document(filename: str):
         }
         
     except Exception as e:
+        # A failed section call arrives wrapped by the task group
+        if isinstance(e, ExceptionGroup):
+            e = e.exceptions[0]
         logger.error(f"Summarization error for {filename}: {str(e)}")
+        if isinstance(e, APIError):
+            # Rate limits, auth and overload keep their status, as in /chat
+            raise chat_http_error(e)
         raise HTTPException(
             status_code=500,
             detail={
@@ -822,34 +2310,41 @@ async def summarize_document(filename: str):
         )
 
 @app.get("/documents")
-async def get_all_documents():
+def get_all_documents():
     return {
         "documents": [
-            {"filename": name, "length": len(text)}
-            for name, text in uploaded_documents.items()
+            {"filename": name, "length": length}
+            for name, length in uploaded_documents.lengths()
         ]
     }
 
 @app.get("/documents/{filename}")
-async def get_document(filename: str):
-    if filename not in uploaded_documents:
+def get_document(filename: str):
+    length = uploaded_documents.length(filename)
+    if length is None:
         raise HTTPException(status_code=404, detail="Document not found")
-    return {"filename": filename, "length": len(uploaded_documents[filename])}
+    return {"filename": filename, "length": length}
 
 @app.delete("/documents/{filename}")
 async def delete_document(filename: str):
-    if filename not in uploaded_documents:
+    try:
+        await run_in_threadpool(uploaded_documents.__delitem__, filename)
+    except KeyError:
         raise HTTPException(status_code=404, detail="Document not found")
-    del uploaded_documents[filename]
+    invalidate_document_caches(filename)
     return {"message": "Document deleted successfully"}
 
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     try:
-        content = await file.read()
+        # Starlette has already spooled the upload to a temporary file; measure
+        # it in place instead of reading the whole body into memory
+        file.file.seek(0, os.SEEK_END)
+        file_size = file.file.tell()
+        file.file.seek(0)
         
         # Validate file is not empty
-        if len(content) == 0:
+        if file_size == 0:
             raise HTTPException(
                 status_code=400,
                 detail={
@@ -859,13 +2354,13 @@ async def upload_file(file: UploadFile = File(...)):
             )
         
         # Validate file size
-        if len(content) > MAX_FILE_SIZE:
+        if file_size > MAX_FILE_SIZE:
             raise HTTPException(
                 status_code=400,
                 detail={
                     "error": "FileTooLarge",
                     "message": f"File too large. Maximum size is {MAX_FILE_SIZE / (1024*1024):.1f}MB",
-                    "detail": f"Your file size: {len(content) / (1024*1024):.2f}MB"
+                    "detail": f"Your file size: {file_size / (1024*1024):.2f}MB"
                 }
             )
         
@@ -879,15 +2374,38 @@ async def upload_file(file: UploadFile = File(...)):
                 }
             )
         
+        # Reject non-PDFs named .pdf from their header instead of hashing and
+        # parsing them first (PDF readers accept the marker in the first 1KB)
         if file.filename.endswith('.pdf'):
+            header = file.file.read(1024)
+            file.file.seek(0)
+            if b"%PDF-" not in header:
+                raise HTTPException(
+                    status_code=400,
+                    detail={
+                        "error": "InvalidPDF",
+                        "message": "Invalid or corrupted PDF file",
+                        "detail": "File does not start with a PDF header"
+                    }
+                )
+        
+        # The same bytes may already be stored (possibly under another name):
+        # reuse that text, chunks and embeddings instead of processing again
+        digest = await run_in_threadpool(hash_upload, file.file)
+        existing = await run_in_threadpool(uploaded_documents.find_digest, digest)
+        
+        if existing is not None and file.filename.endswith(('.pdf', '.txt')):
+            text = existing["full_text"]
+            file_type = "pdf" if file.filename.endswith('.pdf') else "txt"
+        elif file.filename.endswith('.pdf'):
+            # The PDF stack is only loaded once a PDF is actually uploaded
+            import pypdfium2 as pdfium
+            from pdf_extraction import extract_pdf_text
             try:
-                pdf_file = io.BytesIO(content)
-                reader = PdfReader(pdf_file)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text() or ""
+                # Parse in a worker thread so large PDFs don't stall the event loop
+                text = await run_in_threadpool(extract_pdf_text, file.file)
                 file_type = "pdf"
-            except PdfReadError as e:
+            except pdfium.PdfiumError as e:
                 raise HTTPException(
                     status_code=400,
                     detail={
@@ -898,7 +2416,7 @@ async def upload_file(file: UploadFile = File(...)):
                 )
         elif file.filename.endswith('.txt'):
             try:
-                text = content.decode('utf-8')
+                text = await run_in_threadpool(decode_text_upload, file.file)
                 file_type = "txt"
             except UnicodeDecodeError:
                 raise HTTPException(
@@ -917,13 +2435,23 @@ async def upload_file(file: UploadFile = File(...)):
                     "detail": f"Received file type: {file.filename.split('.')[-1] if '.' in file.filename else 'unknown'}"
                 }
             )
-        chunks = chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
-        embeddings = [generate_embedding(chunk) for chunk in chunks]
-        uploaded_documents[file.filename] = {
+        if existing is not None:
+            chunks = existing["chunks"]
+            quantized_embeddings, embedding_scales = existing["embeddings"], existing["embedding_scales"]
+        else:
+            chunks = chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
+            # Encoding is CPU-bound; keep it off the event loop
+            embeddings = await run_in_threadpool(embed_chunks, chunks)
+            # Stored as int8 with per-row scales: a quarter of the float32 footprint
+            quantized_embeddings, embedding_scales = quantize_embeddings(embeddings)
+        await run_in_threadpool(uploaded_documents.__setitem__, file.filename, {
             "full_text": text,  # Keep original for reference
             "chunks": chunks,
-            "embeddings": embeddings
-        }
+            "embeddings": quantized_embeddings,
+            "embedding_scales": embedding_scales,
+            "digest": digest
+        })
+        invalidate_document_caches(file.filename)
         logger.info(f"File uploaded successfully: {file.filename}")
         
         return {
@@ -933,7 +2461,7 @@ async def upload_file(file: UploadFile = File(...)):
             "text_length": len(text),
             "chunk_count": len(chunks),
             "preview": text[:200],
-            "embedding_count": len(embeddings)
+            "embedding_count": len(quantized_embeddings)
         }
         
     except HTTPException:
@@ -953,68 +2481,67 @@ async def upload_file(file: UploadFile = File(...)):
         )
 
 @app.get("/conversations/{session_id}")
-async def get_conversation(session_id: str):
-    """Get conversation history for a session."""
-    if session_id not in conversations:
+def get_conversation(session_id: str, offset: int = 0, limit: Optional[int] = None):
+    """Get conversation history for a session, optionally one page of messages at a time."""
+    history = conversations.get(session_id)
+    if history is None:
         raise HTTPException(
             status_code=404,
             detail="Session not found"
         )
     
+    offset = max(offset, 0)
+    end = None if limit is None else offset + max(limit, 0)
     return {
         "session_id": session_id,
-        "message_count": len(conversations[session_id]),
-        "messages": conversations[session_id]
+        "message_count": len(history),
+        "token_count": history.token_count,
+        "offset": offset,
+        "messages": history[offset:end]
     }
 
 @app.get("/conversations")
-async def list_conversations():
+def list_conversations():
     """List all active conversation sessions."""
     return {
         "sessions": [
             {
                 "session_id": sid,
-                "message_count": len(messages)
+                "message_count": message_count
             }
-            for sid, messages in conversations.items()
+            for sid, message_count in conversations.message_counts()
         ]
     }
 
 @app.delete("/conversations/{session_id}")
 async def delete_conversation(session_id: str):
     """Delete a conversation session."""
-    if session_id not in conversations:
+    if not await run_in_threadpool(conversations.__contains__, session_id):
         raise HTTPException(
             status_code=404,
             detail="Session not found"
         )
     
-    del conversations[session_id]
+    await run_in_threadpool(conversations.__delitem__, session_id)
+    session_contexts.discard(session_id)
     return {"message": "Conversation deleted successfully"}
 
 @app.get("/debug/chunks/{filename}")
-async def debug_chunks(filename: str):
+def debug_chunks(filename: str):
     # Debug endpoint to inspect chunking results.
     
     if filename not in uploaded_documents:
         raise HTTPException(status_code=404, detail="Document not found")
     
     doc = uploaded_documents[filename]
-    chunks = get_document_chunks(filename)
+    chunks = doc["chunks"]
     chunk_count = len(chunks)
-    
-    # Handle both dict (new format) and string (old format)
-    if isinstance(doc, dict):
-        total_length = len(doc["full_text"])
-    else:
-        total_length = len(doc)
-    
+    total_length = len(doc["full_text"])
     first_chunk_preview = chunks[0][:200] if chunks else ""
     
     # Get embeddings info
-    embeddings = get_document_embeddings(filename)
-    embedding_count = len(embeddings) if embeddings else 0
-    has_embeddings = isinstance(doc, dict) and "embeddings" in doc and len(embeddings) > 0
+    embedding_count = len(doc["embeddings"])
+    has_embeddings = embedding_count > 0
     
     return {
         "filename": filename,
@@ -1026,12 +2553,19 @@ async def debug_chunks(filename: str):
     }
 
 @app.get("/")
-async def root():
-    """Root endpoint that returns a welcome message."""
-    return {"message": "Welcome to the Echo API", "endpoints": ["/echo"]}
+def root():
+    """Root endpoint that returns a welcome message and the available endpoints."""
+    return {
+        "message": "Welcome to the AI Study Assistant API",
+        "endpoints": sorted({route.path for route in app.routes if isinstance(route, APIRoute)})
+    }
+
+@lru_cache(maxsize=4096)
+def _echo_json(message: str) -> bytes:
+    return orjson.dumps({"echoed_message": message})
 
 @app.get("/echo")
-async def echo(message: str):
+def echo(message: str):
     """
     Echo endpoint that takes a message parameter and returns it back.
     
@@ -1041,4 +2575,4 @@ async def echo(message: str):
     Returns:
         The echoed message
     """
-    return {"echoed_message": message}
+    return Response(content=_echo_json(message), media_type="application/json")
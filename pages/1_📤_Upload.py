@@ -6,8 +6,11 @@ import streamlit as st
 import sys
 import os
 
-# Add parent directory to path for imports
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Add parent directory to path for imports (once: Streamlit re-runs this
+# script on every interaction)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
 
 from utils.api_client import upload_document, get_documents, delete_document
 
@@ -18,6 +21,10 @@ st.set_page_config(
     layout="wide"
 )
 
+# Filename awaiting delete confirmation (at most one at a time)
+if 'pending_delete' not in st.session_state:
+    st.session_state.pending_delete = None
+
 st.title("📤 Upload Documents")
 st.markdown("Upload PDF or TXT files to build your document library")
 
@@ -111,10 +118,10 @@ else:
                 delete_key = f"delete_{filename}"
                 if st.button("🗑️ Delete", key=delete_key, help=f"Delete {filename}"):
                     # Use session state for confirmation
-                    st.session_state[f"confirm_{filename}"] = True
+                    st.session_state.pending_delete = filename
 
             # Confirmation dialog
-            if st.session_state.get(f"confirm_{filename}", False):
+            if st.session_state.pending_delete == filename:
                 st.warning(f"⚠️ Are you sure you want to delete **{filename}**?")
                 col_a, col_b, col_c = st.columns([1, 1, 4])
 
@@ -126,8 +133,7 @@ else:
                             if delete_result["success"]:
                                 st.success(f"✅ Deleted {filename}")
                                 # Clean up session state
-                                if f"confirm_{filename}" in st.session_state:
-                                    del st.session_state[f"confirm_{filename}"]
+                                st.session_state.pending_delete = None
                                 st.rerun()
                             else:
                                 st.error(f"❌ Delete failed: {delete_result['error']}")
@@ -135,8 +141,7 @@ else:
                 with col_b:
                     if st.button("Cancel", key=f"confirm_no_{filename}"):
                         # Clean up session state
-                        if f"confirm_{filename}" in st.session_state:
-                            del st.session_state[f"confirm_{filename}"]
+                        st.session_state.pending_delete = None
                         st.rerun()
 
             st.markdown("---")
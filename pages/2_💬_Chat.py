@@ -7,11 +7,14 @@ import sys
 import os
 import uuid
 
-# Add parent directory to path for imports
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Add parent directory to path for imports (once: Streamlit re-runs this
+# script on every interaction)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
 
 from utils.api_client import (
-    send_chat_message,
+    stream_chat_message,
     get_documents,
     get_conversations,
     get_conversation,
@@ -142,7 +145,7 @@ with st.sidebar:
     # Session info
     st.subheader("Session Info")
     st.markdown(f"**ID:** `{st.session_state.chat_session_id}`")
-    st.markdown(f"**Messages:** {len(st.session_state.chat_history)}")
+    message_count_text = st.markdown(f"**Messages:** {len(st.session_state.chat_history)}")
 
 # Main chat interface
 st.title("💬 Chat with Documents")
@@ -155,10 +158,11 @@ if not st.session_state.chat_history:
 
 # Display chat history
 chat_container = st.container()
+empty_hint = None
 
 with chat_container:
     if not st.session_state.chat_history:
-        st.info("👋 Start a conversation! Ask me anything about your documents or just chat.")
+        empty_hint = st.info("👋 Start a conversation! Ask me anything about your documents or just chat.")
     else:
         for msg in st.session_state.chat_history:
             role = msg.get("role", "user")
@@ -182,6 +186,9 @@ if user_input:
         st.error("Please select a document first or switch to a different mode.")
         st.stop()
 
+    if empty_hint is not None:
+        empty_hint.empty()
+
     # Add user message to history
     user_message = {"role": "user", "content": user_input}
     st.session_state.chat_history.append(user_message)
@@ -199,49 +206,52 @@ if user_input:
     elif st.session_state.chat_mode == "All Documents":
         use_all_documents = True
 
-    # Send message to backend
+    # Stream the answer from the backend as it is generated
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            result = send_chat_message(
+        final_event = {}
+
+        def answer_deltas():
+            for event in stream_chat_message(
                 message=user_input,
                 document_name=document_name,
                 use_all_documents=use_all_documents,
                 session_id=st.session_state.chat_session_id
-            )
-
-            if result["success"]:
-                response_data = result["data"]
-                response_text = response_data.get("response", "No response")
-
-                # Display response
-                st.markdown(response_text)
+            ):
+                if "delta" in event:
+                    yield event["delta"]
+                else:
+                    final_event.update(event)
+
+        response_text = st.write_stream(answer_deltas())
+
+        if "error" not in final_event:
+            # Show sources if available
+            docs_used = final_event.get("documents_used", [])
+            if docs_used:
+                st.caption(f"📄 Sources: {', '.join(docs_used)}")
+
+            # Add assistant message to history
+            assistant_message = {
+                "role": "assistant",
+                "content": response_text,
+                "documents_used": docs_used
+            }
+            st.session_state.chat_history.append(assistant_message)
 
-                # Show sources if available
-                docs_used = response_data.get("documents_used", [])
-                if docs_used:
-                    st.caption(f"📄 Sources: {', '.join(docs_used)}")
-
-                # Add assistant message to history
-                assistant_message = {
-                    "role": "assistant",
-                    "content": response_text,
-                    "documents_used": docs_used
-                }
-                st.session_state.chat_history.append(assistant_message)
-
-            else:
-                error_message = f"❌ Error: {result['error']}"
-                st.error(error_message)
-
-                # Add error to history
-                assistant_message = {
-                    "role": "assistant",
-                    "content": error_message
-                }
-                st.session_state.chat_history.append(assistant_message)
-
-    # Rerun to update chat display
-    st.rerun()
+        else:
+            error_message = f"❌ Error: {final_event['error']}"
+            st.error(error_message)
+
+            # Add error to history
+            assistant_message = {
+                "role": "assistant",
+                "content": error_message
+            }
+            st.session_state.chat_history.append(assistant_message)
+
+    # The new turn is already on screen; just refresh the sidebar count
+    # instead of rerunning the whole page
+    message_count_text.markdown(f"**Messages:** {len(st.session_state.chat_history)}")
 
 # Tips section
 st.markdown("---")
@@ -6,8 +6,11 @@ import streamlit as st
 import sys
 import os
 
-# Add parent directory to path for imports
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Add parent directory to path for imports (once: Streamlit re-runs this
+# script on every interaction)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
 
 from utils.api_client import get_documents, summarize_document, generate_quiz
 
@@ -28,6 +31,47 @@ if 'quiz_answers' not in st.session_state:
 if 'quiz_submitted' not in st.session_state:
     st.session_state.quiz_submitted = False
 
+# Per-question grading results, computed once per submission
+if 'quiz_graded' not in st.session_state:
+    st.session_state.quiz_graded = None
+
+
+def grade_question(question, user_answer):
+    """Grade one answer; returns what the results view needs to render it"""
+    if question["type"] == "multiple_choice":
+        correct_answer = question.get("correct")
+        is_correct = user_answer == correct_answer
+    else:  # short_answer
+        correct_answer = question.get("correct_answer", "")
+        acceptable = frozenset(v.lower().strip() for v in question.get("acceptable_variations", []))
+        user_answer_lower = str(user_answer).lower().strip()
+        correct_lower = correct_answer.lower().strip()
+
+        is_correct = (
+            user_answer_lower == correct_lower or
+            user_answer_lower in acceptable or
+            correct_lower in user_answer_lower
+        )
+
+    return {
+        "is_correct": is_correct,
+        "user_answer": user_answer,
+        "correct_answer": correct_answer
+    }
+
+
+def retake_quiz():
+    """Button callback: clear answers and results, keep the questions"""
+    st.session_state.quiz_answers = {}
+    st.session_state.quiz_submitted = False
+    st.session_state.quiz_graded = None
+
+
+def new_quiz():
+    """Button callback: discard the quiz and go back to configuration"""
+    st.session_state.quiz_data = None
+    retake_quiz()
+
 st.title("📚 Study Tools")
 st.markdown("Generate summaries and quizzes to enhance your learning")
 
@@ -96,7 +140,7 @@ with tab1:
         ### How It Works
         - The AI analyzes your document and extracts key information
         - Summaries are structured with main topics, key points, and important details
-        - Large documents (>50,000 characters) are automatically truncated
+        - Large documents (>50,000 characters) are summarized section by section, then combined
 
         ### Best For
         - Quick review of document content
@@ -190,6 +234,7 @@ with tab2:
                             st.session_state.quiz_data = result["data"]
                             st.session_state.quiz_answers = {}
                             st.session_state.quiz_submitted = False
+                            st.session_state.quiz_graded = None
                             st.success(f"✅ Generated {len(result['data']['questions'])} questions!")
                             st.rerun()
                         else:
@@ -202,53 +247,57 @@ with tab2:
 
                 questions = st.session_state.quiz_data.get("questions", [])
 
-                for idx, question in enumerate(questions):
-                    st.markdown(f"### Question {idx + 1} of {len(questions)}")
-
-                    q_type = question.get("type")
-                    q_text = question.get("question")
-
-                    st.markdown(f"**{q_text}**")
-
-                    if q_type == "multiple_choice":
-                        # Multiple choice question
-                        options = question.get("options", {})
-                        option_labels = [f"{key}: {value}" for key, value in options.items()]
-
-                        answer = st.radio(
-                            "Select your answer:",
-                            options=list(options.keys()),
-                            format_func=lambda x: f"{x}: {options[x]}",
-                            key=f"q_{idx}",
-                            index=None
-                        )
-
-                        st.session_state.quiz_answers[idx] = {
-                            "type": "multiple_choice",
-                            "answer": answer,
-                            "correct": question.get("correct")
-                        }
-
-                    elif q_type == "short_answer":
-                        # Short answer question
-                        answer = st.text_area(
-                            "Your answer:",
-                            key=f"q_{idx}",
-                            height=100,
-                            placeholder="Type your answer here..."
-                        )
+                # Answers go in a form so editing them doesn't rerun the page;
+                # the script only reruns when the form is submitted
+                with st.form("quiz_form", clear_on_submit=False):
+                    for idx, question in enumerate(questions):
+                        st.markdown(f"### Question {idx + 1} of {len(questions)}")
+
+                        q_type = question.get("type")
+                        q_text = question.get("question")
+
+                        st.markdown(f"**{q_text}**")
+
+                        if q_type == "multiple_choice":
+                            # Multiple choice question
+                            options = question.get("options", {})
+
+                            answer = st.radio(
+                                "Select your answer:",
+                                options=list(options.keys()),
+                                format_func=lambda x: f"{x}: {options[x]}",
+                                key=f"q_{idx}",
+                                index=None
+                            )
+
+                            st.session_state.quiz_answers[idx] = {
+                                "type": "multiple_choice",
+                                "answer": answer,
+                                "correct": question.get("correct")
+                            }
+
+                        elif q_type == "short_answer":
+                            # Short answer question
+                            answer = st.text_area(
+                                "Your answer:",
+                                key=f"q_{idx}",
+                                height=100,
+                                placeholder="Type your answer here..."
+                            )
+
+                            st.session_state.quiz_answers[idx] = {
+                                "type": "short_answer",
+                                "answer": answer,
+                                "correct_answer": question.get("correct_answer", ""),
+                                "acceptable_variations": question.get("acceptable_variations", [])
+                            }
 
-                        st.session_state.quiz_answers[idx] = {
-                            "type": "short_answer",
-                            "answer": answer,
-                            "correct_answer": question.get("correct_answer", ""),
-                            "acceptable_variations": question.get("acceptable_variations", [])
-                        }
+                        st.markdown("---")
 
-                    st.markdown("---")
+                    submitted = st.form_submit_button("Submit Answers", type="primary")
 
                 # Submit button
-                if st.button("Submit Answers", type="primary", key="submit_quiz_btn"):
+                if submitted:
                     # Check if all questions are answered
                     all_answered = all(
                         st.session_state.quiz_answers.get(i, {}).get("answer")
@@ -259,6 +308,7 @@ with tab2:
                         st.warning("⚠️ Please answer all questions before submitting.")
                     else:
                         st.session_state.quiz_submitted = True
+                        st.session_state.quiz_graded = None
                         st.rerun()
 
             # Display quiz results
@@ -267,30 +317,16 @@ with tab2:
                 st.subheader("📊 Quiz Results")
 
                 questions = st.session_state.quiz_data.get("questions", [])
-                correct_count = 0
                 total_questions = len(questions)
 
-                # Calculate score
-                for idx, question in enumerate(questions):
-                    user_answer_data = st.session_state.quiz_answers.get(idx, {})
-                    user_answer = user_answer_data.get("answer", "")
-
-                    if question["type"] == "multiple_choice":
-                        correct_answer = question.get("correct")
-                        is_correct = user_answer == correct_answer
-                    else:  # short_answer
-                        correct_answer = question.get("correct_answer", "").lower().strip()
-                        acceptable = [v.lower().strip() for v in question.get("acceptable_variations", [])]
-                        user_answer_lower = str(user_answer).lower().strip()
-
-                        is_correct = (
-                            user_answer_lower == correct_answer or
-                            user_answer_lower in acceptable or
-                            correct_answer in user_answer_lower
-                        )
-
-                    if is_correct:
-                        correct_count += 1
+                # Grade once per submission; later reruns reuse the results
+                if st.session_state.quiz_graded is None:
+                    st.session_state.quiz_graded = [
+                        grade_question(question, st.session_state.quiz_answers.get(idx, {}).get("answer", ""))
+                        for idx, question in enumerate(questions)
+                    ]
+                graded = st.session_state.quiz_graded
+                correct_count = sum(result["is_correct"] for result in graded)
 
                 # Display score
                 score_percentage = (correct_count / total_questions) * 100 if total_questions > 0 else 0
@@ -311,29 +347,14 @@ with tab2:
                 st.markdown("---")
 
                 # Display detailed results
-                for idx, question in enumerate(questions):
-                    user_answer_data = st.session_state.quiz_answers.get(idx, {})
-                    user_answer = user_answer_data.get("answer", "")
+                for idx, (question, result) in enumerate(zip(questions, graded)):
+                    user_answer = result["user_answer"]
+                    correct_answer = result["correct_answer"]
+                    is_correct = result["is_correct"]
 
                     q_text = question.get("question")
                     explanation = question.get("explanation", "")
-
-                    # Determine if correct
-                    if question["type"] == "multiple_choice":
-                        correct_answer = question.get("correct")
-                        is_correct = user_answer == correct_answer
-                        options = question.get("options", {})
-                    else:  # short_answer
-                        correct_answer = question.get("correct_answer", "")
-                        acceptable = [v.lower().strip() for v in question.get("acceptable_variations", [])]
-                        user_answer_lower = str(user_answer).lower().strip()
-                        correct_lower = correct_answer.lower().strip()
-
-                        is_correct = (
-                            user_answer_lower == correct_lower or
-                            user_answer_lower in acceptable or
-                            correct_lower in user_answer_lower
-                        )
+                    options = question.get("options", {})
 
                     # Display result
                     if is_correct:
@@ -357,18 +378,12 @@ with tab2:
 
                 # Action buttons
                 col1, col2 = st.columns(2)
+                # Callbacks run before the click's rerun, so no st.rerun() is needed
                 with col1:
-                    if st.button("📝 Retake Quiz", type="primary"):
-                        st.session_state.quiz_answers = {}
-                        st.session_state.quiz_submitted = False
-                        st.rerun()
+                    st.button("📝 Retake Quiz", type="primary", on_click=retake_quiz)
 
                 with col2:
-                    if st.button("🎯 New Quiz"):
-                        st.session_state.quiz_data = None
-                        st.session_state.quiz_answers = {}
-                        st.session_state.quiz_submitted = False
-                        st.rerun()
+                    st.button("🎯 New Quiz", on_click=new_quiz)
 
     # Tips
     with st.expander("💡 Quiz Tips", expanded=False):
@@ -0,0 +1,87 @@
+"""
+PDF text extraction helpers
+Kept separate from main.py so process-pool workers only import pypdfium2
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import pypdfium2 as pdfium
+
+# Below this many pages, pool start-up and IPC cost more than they save
+PARALLEL_MIN_PAGES = 32
+# Extraction processes per server worker; every uvicorn worker gets its own
+# pool, so with several workers use cores / workers
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0")) or min(os.cpu_count() or 1, 4)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn, not fork: a forked child would copy the server process with
+        # its loaded embedding model, threads and open database connections
+        _executor = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def _extract_page_range(path: str, start: int, stop: int) -> str:
+    """Extract text from pages [start, stop) - runs inside a worker process"""
+    pdf = pdfium.PdfDocument(path)
+    try:
+        return "".join(pdf[i].get_textpage().get_text_range() for i in range(start, stop))
+    finally:
+        pdf.close()
+
+
+def extract_pdf_text(source) -> str:
+    """
+    Extract text from every page of a PDF using PDFium
+
+    Args:
+        source: PDF bytes or a binary file object
+
+    Returns:
+        Text of all pages concatenated in page order
+    """
+    pdf = pdfium.PdfDocument(source)
+    try:
+        page_count = len(pdf)
+        if page_count < PARALLEL_MIN_PAGES:
+            return "".join(page.get_textpage().get_text_range() for page in pdf)
+    finally:
+        pdf.close()
+
+    # Large PDF: give each worker a contiguous page range to extract. Workers
+    # open the PDF from a temporary file, so it is never held in memory or
+    # pickled to every task
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        if isinstance(source, bytes):
+            tmp.write(source)
+        else:
+            source.seek(0)
+            shutil.copyfileobj(source, tmp)
+    try:
+        step = -(-page_count // PDF_WORKERS)
+        starts = list(range(0, page_count, step))
+        stops = [min(start + step, page_count) for start in starts]
+        parts = _get_executor().map(_extract_page_range, [tmp.name] * len(starts), starts, stops)
+        return "".join(parts)
+    finally:
+        os.unlink(tmp.name)
+
+
+def shutdown() -> None:
+    """Stop the worker processes, if any were started"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
@@ -2,12 +2,15 @@ import requests
 
 BASE_URL = "http://localhost:8000"
 
+# One keep-alive connection for the upload and the chat call
+session = requests.Session()
+
 # Step 1: Upload PDF (if not already uploaded)
 print("1. Uploading test.pdf...")
 try:
     with open("test.pdf", "rb") as f:
         files = {"file": ("test.pdf", f, "application/pdf")}
-        response = requests.post(f"{BASE_URL}/upload", files=files)
+        response = session.post(f"{BASE_URL}/upload", files=files)
         if response.status_code == 200:
             print("PDF uploaded successfully")
             filename = response.json()["filename"]
@@ -30,7 +33,7 @@ chat_data = {
     "document_name": filename
 }
 
-response = requests.post(f"{BASE_URL}/chat", json=chat_data)
+response = session.post(f"{BASE_URL}/chat", json=chat_data)
 
 if response.status_code == 200:
     print("\n" + "="*60)
@@ -0,0 +1,8 @@
+"""
+Shared test setup. main.py checks for an API key when imported, so give it
+a dummy one before any test imports it.
+"""
+
+import os
+
+os.environ["ANTHROPIC_API_KEY"] = "test-key"
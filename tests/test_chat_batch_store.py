@@ -0,0 +1,45 @@
+"""
+ChatBatchStore: a finished batch request is merged by exactly one worker
+"""
+
+import numpy as np
+
+from main import ChatBatchStore
+
+
+def make_row(custom_id: str, question_embedding=None) -> dict:
+    return {
+        "custom_id": custom_id,
+        "batch_id": "msgbatch_1",
+        "session_id": "default",
+        "message": "What is DNA?",
+        "response": None,
+        "merged": 0,
+        "cache_entry": None if question_embedding is None else '{"scope": ["general"]}',
+        "question_embedding": question_embedding
+    }
+
+
+def test_only_the_first_worker_claims_a_row(tmp_path):
+    path = str(tmp_path / "documents.db")
+    first, second = ChatBatchStore(path), ChatBatchStore(path)
+    first.add([make_row("turn-0")])
+
+    assert first.mark_merged("turn-0", "An answer", None)
+    assert not second.mark_merged("turn-0", "Another answer", None)
+
+    [row] = second.get("msgbatch_1")
+    assert row["merged"]
+    assert row["response"] == "An answer"
+
+
+def test_question_embedding_round_trips(tmp_path):
+    store = ChatBatchStore(str(tmp_path / "documents.db"))
+    embedding = np.linspace(-1, 1, 8, dtype=np.float32)
+    store.add([make_row("turn-0", embedding), make_row("turn-1")])
+
+    cached, uncached = store.get("msgbatch_1")
+    np.testing.assert_array_equal(cached["question_embedding"], embedding)
+    assert cached["cache_entry"] == {"scope": ["general"]}
+    assert uncached["question_embedding"] is None
+    assert uncached["cache_entry"] is None
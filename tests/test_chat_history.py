@@ -0,0 +1,42 @@
+"""
+ChatHistory trimming: whole user/assistant pairs, and pending turns can be
+rolled back
+"""
+
+from main import ChatHistory
+
+
+def exchange(history: ChatHistory, number: int, length: int = 1) -> None:
+    history.append({"role": "user", "content": f"q{number}".ljust(length)})
+    history.append({"role": "assistant", "content": f"a{number}".ljust(length)})
+
+
+def test_oldest_pairs_are_dropped_past_max_messages():
+    history = ChatHistory(max_messages=4)
+    for number in range(3):
+        exchange(history, number)
+
+    assert [m["content"] for m in history] == ["q1", "a1", "q2", "a2"]
+    assert history[0]["role"] == "user"
+
+
+def test_pending_user_turn_is_not_trimmed_and_can_be_rolled_back():
+    history = ChatHistory(max_messages=4)
+    for number in range(2):
+        exchange(history, number)
+
+    history.append({"role": "user", "content": "pending"})
+    assert len(history) == 5  # Trimming waits for the assistant reply
+    history.pop()
+
+    assert [m["content"] for m in history] == ["q0", "a0", "q1", "a1"]
+
+
+def test_max_chars_drops_pairs_but_keeps_the_latest():
+    history = ChatHistory(max_messages=50, max_chars=25)
+    exchange(history, 0, length=10)
+    exchange(history, 1, length=10)
+    assert [m["content"].strip() for m in history] == ["q1", "a1"]
+
+    exchange(history, 2, length=100)  # Over the cap on its own
+    assert [m["content"].strip() for m in history] == ["q2", "a2"]
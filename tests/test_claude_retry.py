@@ -0,0 +1,85 @@
+"""
+Claude call admission: the per-minute token budget and which errors are
+retried, and how long to wait
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+from anthropic import APIConnectionError, BadRequestError, RateLimitError
+
+from main import CLAUDE_MAX_RETRIES, RequestRateLimiter, retry_delay
+
+REQUEST = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+
+
+def rate_limit_error(headers: dict) -> RateLimitError:
+    response = httpx.Response(429, headers=headers, request=REQUEST)
+    return RateLimitError("rate limited", response=response, body=None)
+
+
+def test_rate_limit_honors_retry_after():
+    assert retry_delay(rate_limit_error({"retry-after": "7"}), attempt=0) == 7.0
+
+
+def test_rate_limit_without_retry_after_backs_off_exponentially():
+    assert retry_delay(rate_limit_error({}), attempt=0) == 1.0
+    assert retry_delay(rate_limit_error({"retry-after": "soon"}), attempt=2) == 4.0
+
+
+def test_connection_errors_back_off_exponentially():
+    assert retry_delay(APIConnectionError(request=REQUEST), attempt=1) == 2.0
+
+
+def test_last_attempt_is_not_retried():
+    error = rate_limit_error({"retry-after": "1"})
+    assert retry_delay(error, attempt=CLAUDE_MAX_RETRIES - 1) is None
+
+
+def test_client_errors_are_not_retried():
+    response = httpx.Response(400, request=REQUEST)
+    error = BadRequestError("bad request", response=response, body=None)
+    assert retry_delay(error, attempt=0) is None
+
+
+def try_acquire(limiter: RequestRateLimiter, tokens: int):
+    """The charge if admitted right away, None if the call would have to wait"""
+    async def attempt():
+        try:
+            return await asyncio.wait_for(limiter.acquire(tokens), 0.05)
+        except asyncio.TimeoutError:
+            return None
+    return asyncio.run(attempt())
+
+
+def test_estimate_is_charged_at_admission():
+    limiter = RequestRateLimiter(requests_per_minute=100, input_tokens_per_minute=1000)
+    assert try_acquire(limiter, 900) is not None
+    assert try_acquire(limiter, 200) is None
+
+
+def test_usage_corrects_the_original_charge():
+    limiter = RequestRateLimiter(requests_per_minute=100, input_tokens_per_minute=1000)
+    charge = try_acquire(limiter, 900)
+    limiter.record_usage(charge, SimpleNamespace(input_tokens=100))
+
+    assert limiter.tokens_in_window == 100
+    assert len(limiter.token_usage) == 1  # Corrected in place, not a second entry
+    assert try_acquire(limiter, 800) is not None
+
+
+def test_failed_attempts_are_refunded():
+    limiter = RequestRateLimiter(requests_per_minute=100, input_tokens_per_minute=1000)
+    limiter.refund(try_acquire(limiter, 900))
+    assert limiter.tokens_in_window == 0
+
+
+def test_expired_charges_leave_the_window_with_their_final_value():
+    limiter = RequestRateLimiter(requests_per_minute=100, input_tokens_per_minute=1000)
+    charge = try_acquire(limiter, 900)
+    charge[0] -= 60  # Admitted a minute ago
+    limiter._expire(charge[0] + 60)
+    limiter.record_usage(charge, SimpleNamespace(input_tokens=100))
+
+    assert limiter.tokens_in_window == 0
@@ -0,0 +1,65 @@
+"""
+DocumentStore behaviour when several workers share one database file
+"""
+
+import numpy as np
+import pytest
+
+from main import DocumentStore, quantize_embeddings
+
+
+def make_doc(text: str, digest: str) -> dict:
+    embeddings, scales = quantize_embeddings(np.eye(2, 4, dtype=np.float32))
+    return {
+        "full_text": text,
+        "chunks": [text, text],
+        "embeddings": embeddings,
+        "embedding_scales": scales,
+        "digest": digest
+    }
+
+
+@pytest.fixture
+def stores(tmp_path):
+    """Two stores on one file, standing in for two uvicorn workers"""
+    path = str(tmp_path / "documents.db")
+    return DocumentStore(path), DocumentStore(path)
+
+
+def test_replace_on_other_worker_is_not_served_from_hot_cache(stores):
+    first, second = stores
+    first["notes.txt"] = make_doc("old text", "digest-old")
+    assert second["notes.txt"]["full_text"] == "old text"  # now hot in second
+
+    first["notes.txt"] = make_doc("new text", "digest-new")
+
+    doc = second["notes.txt"]
+    assert doc["full_text"] == "new text"
+    assert doc["digest"] == "digest-new"
+
+
+def test_delete_on_other_worker_is_not_served_from_hot_cache(stores):
+    first, second = stores
+    first["notes.txt"] = make_doc("some text", "digest-1")
+    assert second["notes.txt"]["full_text"] == "some text"
+
+    del first["notes.txt"]
+
+    assert "notes.txt" not in second
+    with pytest.raises(KeyError):
+        second["notes.txt"]
+    assert "notes.txt" not in second.hot
+
+
+def test_changes_bump_the_shared_version(stores):
+    first, second = stores
+    start = second.version()
+    first["notes.txt"] = make_doc("some text", "digest-1")
+    assert second.version() > start
+    assert second.digests() == {"notes.txt": "digest-1"}
+
+    before_delete = second.version()
+    del first["notes.txt"]
+    assert second.version() > before_delete
+    assert second.digests() == {}
+
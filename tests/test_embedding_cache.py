@@ -0,0 +1,21 @@
+"""
+EmbeddingCache: bounded, evicting the least recently used chunks
+"""
+
+import numpy as np
+
+from main import EmbeddingCache
+
+
+def test_least_recently_used_entries_are_pruned(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "documents.db"), max_entries=2)
+    keys = [EmbeddingCache.key(text) for text in ("first", "second", "third")]
+    embeddings = np.eye(3, 4, dtype=np.float32)
+
+    cache.put_many(keys[:2], embeddings[:2])
+    cache.conn.execute("UPDATE embedding_cache SET last_used = 0 WHERE hash = ?", (keys[1],))
+    cache.put_many(keys[2:], embeddings[2:])
+
+    found = cache.get_many(keys)
+    assert set(found) == {keys[0], keys[2]}
+    np.testing.assert_array_equal(found[keys[2]], embeddings[2])
@@ -0,0 +1,42 @@
+"""
+Embedding quantization and int8 scoring
+"""
+
+import numpy as np
+
+import main
+from main import find_relevant_chunk_indices, quantize_embeddings
+
+
+def random_embeddings(rows: int, dim: int = 16) -> np.ndarray:
+    embeddings = np.random.default_rng(0).standard_normal((rows, dim)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def test_quantize_round_trip_is_close():
+    embeddings = random_embeddings(8)
+    quantized, scales = quantize_embeddings(embeddings)
+
+    assert quantized.dtype == np.int8
+    assert scales.dtype == np.float32
+    np.testing.assert_allclose(quantized * scales[:, None], embeddings, atol=0.01)
+
+
+def test_quantize_handles_zero_rows():
+    quantized, scales = quantize_embeddings(np.zeros((2, 4)))
+    assert not quantized.any()
+    assert np.isfinite(scales).all()
+
+
+def test_int8_scoring_matches_float32(monkeypatch):
+    # Small blocks so the scan crosses several block boundaries
+    monkeypatch.setattr(main, "SCORE_BLOCK_ROWS", 7)
+    embeddings = random_embeddings(50)
+    quantized, scales = quantize_embeddings(embeddings)
+    query = embeddings[17] + 0.05
+
+    expected = find_relevant_chunk_indices(query, embeddings, top_k=5)
+    actual = find_relevant_chunk_indices(query, quantized, top_k=5, scales=scales)
+
+    assert actual[0] == expected[0] == 17
+    assert set(actual) == set(expected)
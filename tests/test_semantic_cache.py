@@ -0,0 +1,22 @@
+"""
+Answer-cache question keys and exact-match lookup
+"""
+
+import numpy as np
+
+from main import SemanticCache, normalize_question
+
+
+def test_normalize_question_folds_trivial_differences():
+    assert normalize_question("  What is  DNA? ") == normalize_question("what is dna")
+    assert normalize_question("Ｗhat is DNA!") == "what is dna"
+    assert normalize_question("What is RNA?") != normalize_question("What is DNA?")
+
+
+def test_lookup_exact_hits_on_normalized_question():
+    cache = SemanticCache()
+    result = {"answer": "Deoxyribonucleic acid"}
+    cache.insert(("general",), "What is DNA?", np.ones(4, dtype=np.float32), result)
+
+    assert cache.lookup_exact(("general",), "  what is dna ") is result
+    assert cache.lookup_exact(("document", "notes.pdf"), "What is DNA?") is None
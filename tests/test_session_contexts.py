@@ -0,0 +1,41 @@
+"""
+SessionContextCache: LRU eviction, idle expiry and scope invalidation
+"""
+
+from main import SessionContextCache
+
+
+def context(scope: tuple) -> dict:
+    return {"scope": scope, "system_prompt": "sections"}
+
+
+def test_least_recently_used_context_is_evicted():
+    cache = SessionContextCache(maxsize=2)
+    cache.put("a", context(("all",)))
+    cache.put("b", context(("all",)))
+    cache.get("a")
+    cache.put("c", context(("all",)))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_idle_contexts_expire():
+    cache = SessionContextCache(ttl=-1)
+    cache.put("a", context(("all",)))
+
+    assert cache.get("a") is None
+
+
+def test_invalidate_scopes_keeps_other_documents():
+    cache = SessionContextCache()
+    cache.put("a", context(("document", "notes.pdf")))
+    cache.put("b", context(("document", "other.pdf")))
+    cache.put("c", context(("all",)))
+
+    cache.invalidate_scopes({("document", "notes.pdf"), ("all",)})
+
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+    assert cache.get("b") is not None
@@ -0,0 +1,20 @@
+"""
+decode_text_upload: block-wise UTF-8 validation of TXT uploads
+"""
+
+import io
+
+import pytest
+
+from main import decode_text_upload
+
+
+def test_characters_split_across_blocks_decode():
+    # 1MB of ASCII then a two-byte character straddling the block boundary
+    content = b"a" * (1024 * 1024 - 1) + "é".encode() + b" and more"
+    assert decode_text_upload(io.BytesIO(content)) == content.decode("utf-8")
+
+
+def test_invalid_utf8_is_rejected():
+    with pytest.raises(UnicodeDecodeError):
+        decode_text_upload(io.BytesIO(b"notes\xff"))
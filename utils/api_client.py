@@ -3,13 +3,46 @@ API Client for AI Study Assistant Backend
 Handles all HTTP communication with the FastAPI backend
 """
 
+import orjson
 import requests
 import os
-from typing import Optional, Dict, Any, List
+import streamlit as st
+from typing import Optional, Dict, Any, List, Iterator
 
 # Backend configuration
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
+# One pooled session so calls reuse keep-alive connections to the backend.
+# Streamlit serves each browser session from its own thread, so size the
+# pool for several concurrent requests
+_session = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=20)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+
+class _RequestFailed(Exception):
+    """Carries a failed response out of a cached function, so st.cache_data doesn't store it"""
+
+    def __init__(self, result: Dict[str, Any]):
+        super().__init__(result["error"])
+        self.result = result
+
+
+def _cacheable(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a successful response; raise _RequestFailed for a failed one"""
+    if not result["success"]:
+        raise _RequestFailed(result)
+    return result
+
+
+def _uncached_failure(fetch) -> Dict[str, Any]:
+    """Call a cached fetch function, returning its failure response (uncached) if it raised"""
+    try:
+        return fetch()
+    except _RequestFailed as e:
+        return e.result
+
 
 def _make_request(method: str, endpoint: str, **kwargs) -> Dict[str, Any]:
     """
@@ -25,21 +58,23 @@ def _make_request(method: str, endpoint: str, **kwargs) -> Dict[str, Any]:
     """
     try:
         url = f"{BACKEND_URL}{endpoint}"
-        response = requests.request(method, url, timeout=30, **kwargs)
+        response = _session.request(method, url, timeout=30, **kwargs)
+
+        # Parse the body once, straight from bytes
+        body = orjson.loads(response.content) if response.content else {}
 
         # Check for HTTP errors
         if response.status_code >= 400:
-            error_data = response.json() if response.content else {}
             return {
                 "success": False,
                 "data": None,
-                "error": error_data.get("message", f"HTTP {response.status_code} error")
+                "error": body.get("message", f"HTTP {response.status_code} error")
             }
 
         # Success
         return {
             "success": True,
-            "data": response.json() if response.content else {},
+            "data": body,
             "error": None
         }
 
@@ -83,7 +118,10 @@ def upload_document(file) -> Dict[str, Any]:
     """
     try:
         files = {"file": (file.name, file, file.type)}
-        return _make_request("post", "/upload", files=files)
+        result = _make_request("post", "/upload", files=files)
+        if result["success"]:
+            _fetch_documents.clear()
+        return result
     except Exception as e:
         return {
             "success": False,
@@ -92,14 +130,21 @@ def upload_document(file) -> Dict[str, Any]:
         }
 
 
+@st.cache_data(ttl=10, show_spinner=False)
+def _fetch_documents() -> Dict[str, Any]:
+    return _cacheable(_make_request("get", "/documents"))
+
+
 def get_documents() -> Dict[str, Any]:
     """
     Get list of all uploaded documents
+    Successes are cached for 10 seconds so reruns don't refetch; cleared on
+    upload/delete. Failures are never cached.
 
     Returns:
         Response dict with success status and data containing documents list
     """
-    return _make_request("get", "/documents")
+    return _uncached_failure(_fetch_documents)
 
 
 def delete_document(filename: str) -> Dict[str, Any]:
@@ -112,7 +157,10 @@ def delete_document(filename: str) -> Dict[str, Any]:
     Returns:
         Response dict with success status and confirmation message
     """
-    return _make_request("delete", f"/documents/{filename}")
+    result = _make_request("delete", f"/documents/{filename}")
+    if result["success"]:
+        _fetch_documents.clear()
+    return result
 
 
 # Chat Functions
@@ -145,17 +193,94 @@ def send_chat_message(
     if use_all_documents:
         payload["use_all_documents"] = True
 
-    return _make_request("post", "/chat", json=payload)
+    result = _make_request("post", "/chat", json=payload)
+    if result["success"]:
+        _fetch_conversations.clear()
+    return result
+
+
+def stream_chat_message(
+    message: str,
+    document_name: Optional[str] = None,
+    use_all_documents: bool = False,
+    session_id: str = "default"
+) -> Iterator[Dict[str, Any]]:
+    """
+    Send a chat message and yield the answer as it streams back
+
+    Args:
+        message: User's message/question
+        document_name: Optional single document to query
+        use_all_documents: Whether to use all documents for context
+        session_id: Chat session identifier
+
+    Yields:
+        {"delta": text} events, then one final event: the /chat metadata
+        with "done": True, or {"error": message} if the request failed
+    """
+    payload = {
+        "message": message,
+        "session_id": session_id
+    }
+
+    if document_name:
+        payload["document_name"] = document_name
+    if use_all_documents:
+        payload["use_all_documents"] = True
+
+    try:
+        with _session.post(f"{BACKEND_URL}/chat/stream", json=payload, stream=True, timeout=30) as response:
+            if response.status_code >= 400:
+                error_data = orjson.loads(response.content) if response.content else {}
+                detail = error_data.get("detail")
+                yield {"error": _error_message(detail, f"HTTP {response.status_code} error")}
+                return
+
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                event = orjson.loads(line[len(b"data: "):])
+                if "error" in event:
+                    yield {"error": _error_message(event["error"], f"HTTP {event.get('status_code')} error")}
+                    return
+                if event.get("done"):
+                    _fetch_conversations.clear()
+                yield event
+
+    except requests.exceptions.ConnectionError:
+        yield {"error": "Cannot connect to backend server. Make sure it's running on " + BACKEND_URL}
+    except requests.exceptions.Timeout:
+        yield {"error": "Request timed out. The server might be busy."}
+    except requests.exceptions.RequestException as e:
+        yield {"error": f"Request error: {str(e)}"}
+    except Exception as e:
+        yield {"error": f"Unexpected error: {str(e)}"}
+
+
+def _error_message(detail: Any, default: str) -> str:
+    """Pull the human-readable message out of a backend error detail"""
+    if isinstance(detail, dict):
+        return detail.get("message") or default
+    if isinstance(detail, str):
+        return detail
+    return default
+
+
+@st.cache_data(ttl=5, show_spinner=False)
+def _fetch_conversations() -> Dict[str, Any]:
+    return _cacheable(_make_request("get", "/conversations"))
 
 
 def get_conversations() -> Dict[str, Any]:
     """
     Get list of all conversation sessions
+    Successes are cached for 5 seconds; cleared when a chat message is sent
+    or a session deleted. Failures are never cached.
 
     Returns:
         Response dict with list of sessions and their message counts
     """
-    return _make_request("get", "/conversations")
+    return _uncached_failure(_fetch_conversations)
 
 
 def get_conversation(session_id: str) -> Dict[str, Any]:
@@ -181,7 +306,10 @@ def delete_conversation(session_id: str) -> Dict[str, Any]:
     Returns:
         Response dict with success confirmation
     """
-    return _make_request("delete", f"/conversations/{session_id}")
+    result = _make_request("delete", f"/conversations/{session_id}")
+    if result["success"]:
+        _fetch_conversations.clear()
+    return result
 
 
 # Study Tools Functions